@@ -0,0 +1,75 @@
+from os.path import dirname, abspath
+from argparse import ArgumentParser
+from time import perf_counter
+import sys
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from pages import fitting_utils
+from pages.measurements import MeasurementIndex
+
+# Compares the figure formats of the parameters table on the Fitting page, the
+# time to render the figures and the size of the callback payload.
+# Usage: python benchmarks/figures.py [--rows N] [--timepoints N]
+
+FORMATS = ["png", "plotly"]
+
+
+def synthetic_group(group, n_concentrations, n_timepoints, replicates=3):
+    # Measurements and fitted curves of one species and carbon source.
+    rng = np.random.default_rng(group)
+    t = np.linspace(0, 48, n_timepoints)
+    concentrations = 10.0 / 2 ** np.arange(n_concentrations)
+    rows, linegroups, cur_df = [], [], []
+    for k, conc in enumerate(concentrations):
+        fit = fitting_utils.monod_biomass(t, 0.01, conc, 0.8, 2.0, 0.05, "odeint")
+        cur_df.append(pd.DataFrame({"time": t, "measurement": fit}))
+        lgs = [
+            "g" + str(group) + "_c" + str(k) + "_r" + str(r) for r in range(replicates)
+        ]
+        for lg in lgs:
+            rows.append(
+                pd.DataFrame(
+                    {
+                        "linegroup": lg,
+                        "time": t,
+                        "measurement": fit + rng.normal(0, 5e-3, n_timepoints),
+                    }
+                )
+            )
+        linegroups.append(lgs)
+    return pd.concat(rows), cur_df, concentrations, linegroups
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark of the fitting table figures.")
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--concentrations", type=int, default=5)
+    parser.add_argument("--timepoints", type=int, default=400)
+    args = parser.parse_args()
+
+    groups = [
+        synthetic_group(group, args.concentrations, args.timepoints)
+        for group in range(args.rows)
+    ]
+    measurement_index = MeasurementIndex(pd.concat([group[0] for group in groups]))
+    results = {}
+    for figure_format in FORMATS:
+        fitting_utils.FIT_FIGURES = figure_format
+        start = perf_counter()
+        cells = [
+            fitting_utils.figure_cell(
+                measurement_index, cur_df, concentrations, linegroups
+            )
+            for _, cur_df, concentrations, linegroups in groups
+        ]
+        seconds = perf_counter() - start
+        payload = len(to_json_plotly(fitting_utils.parameters_table(cells)))
+        results[figure_format] = {
+            "render per row (ms)": seconds / args.rows * 1000,
+            "payload (kB)": payload / 1024,
+            "payload per row (kB)": payload / 1024 / args.rows,
+        }
+    print(pd.DataFrame(results).T.round(1).to_string())
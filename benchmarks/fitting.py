@@ -0,0 +1,78 @@
+from os.path import dirname, abspath
+from argparse import ArgumentParser
+from time import perf_counter
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from pages import fitting_utils
+
+# Compares the Monod solvers of fitting_utils on synthetic growth curves, the
+# accuracy against odeint and the time of the fit of one carbon source.
+# Usage: python benchmarks/fitting.py [--concentrations N] [--timepoints N]
+
+SOLVERS = ["odeint", "closed_form", "rk45"]
+
+
+def synthetic_args(n_concentrations, n_timepoints, v=0.8, Km=2.0, q=0.05):
+    # Growth curves of one species on a dilution series of a carbon source.
+    rng = np.random.default_rng(0)
+    t = np.linspace(0, 24, n_timepoints)
+    c0 = 10.0 / 2 ** np.arange(n_concentrations)
+    n0 = np.full(n_concentrations, 0.01)
+    series = [
+        fitting_utils.monod_biomass(t, n0[i], c0[i], v, Km, q, "odeint")
+        + rng.normal(0, 1e-3, n_timepoints)
+        for i in range(n_concentrations)
+    ]
+    growth_rates = [fitting_utils.est_vmax(t, np.abs(n)) for n in series]
+    return [
+        [t] * n_concentrations,
+        series,
+        c0,
+        n0,
+        [q] * n_concentrations,
+        growth_rates,
+    ]
+
+
+def accuracy(solver):
+    # Largest deviation from odeint relative to the final biomass.
+    t = np.linspace(0, 48, 500)
+    errors = []
+    for Km in [0.001, 0.1, 1, 100]:
+        for q in [0.01, 1, 100]:
+            for v in [0.1, 1, 3]:
+                reference = fitting_utils.monod_biomass(t, 1, 1, v, Km, q, "odeint")
+                biomass = fitting_utils.monod_biomass(t, 1, 1, v, Km, q, solver)
+                errors.append(np.max(np.abs(biomass - reference)) / np.max(reference))
+    return np.max(errors)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark of the Monod solvers.")
+    parser.add_argument("--concentrations", type=int, default=6)
+    parser.add_argument("--timepoints", type=int, default=200)
+    args = parser.parse_args()
+
+    fit_args = synthetic_args(args.concentrations, args.timepoints)
+    t, series, c0, n0, q, growth_rates = fit_args
+    results = {}
+    for solver in SOLVERS:
+        start = perf_counter()
+        for i in range(20):
+            fitting_utils.simulate_monod([2.0, 0.8], t, q, series, c0, n0, solver)
+        objective = (perf_counter() - start) / 20
+        start = perf_counter()
+        v, Km = fitting_utils.get_params(
+            fit_args, rng=np.random.default_rng(0), solver=solver
+        )
+        results[solver] = {
+            "deviation": accuracy(solver),
+            "objective (ms)": objective * 1000,
+            "fit (s)": perf_counter() - start,
+            "v_max": v,
+            "Km": Km,
+        }
+    print(pd.DataFrame(results).T.to_string(float_format="{:.4g}".format))
@@ -0,0 +1,112 @@
+from os.path import join, dirname, abspath
+from tempfile import TemporaryDirectory
+from string import ascii_uppercase
+from logging import getLogger
+from argparse import ArgumentParser
+from time import perf_counter
+from os import makedirs
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+import parse_data
+
+# Times the ingest of a synthetic plate for the common plate formats.
+# Usage: python benchmarks/ingest.py [--timepoints N]
+
+PLATE_FORMATS = {96: (8, 12), 384: (16, 24), 1536: (32, 48)}
+
+
+def row_names(n_rows):
+    # A-Z followed by AA, AB, ... as used for 1536 well plates
+    names = list(ascii_uppercase) + ["A" + letter for letter in ascii_uppercase]
+    return names[:n_rows]
+
+
+def write_plate(plate_dir, n_rows, n_cols, n_timepoints, replicates=3):
+    # Writes combined_metadata.xlsx and data.xlsx of a plate where the first
+    # column holds the blanks and the other wells are samples in triplicates.
+    makedirs(plate_dir)
+    rows = row_names(n_rows)
+    cols = list(range(1, n_cols + 1))
+    groups = pd.DataFrame(index=rows, columns=cols, dtype=object)
+    for r, row in enumerate(rows):
+        groups.at[row, 1] = "B" + str(r)
+        for c in cols[1:]:
+            sample = (r * (n_cols - 1) + c - 2) // replicates
+            groups.at[row, c] = "S" + str(sample) + "B" + str(r)
+
+    def plate_sheet(value):
+        return pd.DataFrame(value, index=rows, columns=cols)
+
+    sheets = {
+        "Metadata": pd.DataFrame(
+            {
+                "Experimenter's Name": ["Benchmark"],
+                "Experiment description": ["Synthetic plate"],
+                "Date of Experiment (DD/MM/YY)": ["01.01.24"],
+                "Device Used": ["Plate reader"],
+                "Temperature": [30],
+                "Shaking (rpm)": [200],
+                "CO2 (Y/N)": ["N"],
+            }
+        ),
+        "Groups": groups,
+        "Species": plate_sheet("Species"),
+        "Carbon Source": plate_sheet("Glucose"),
+        "CS Concentration": plate_sheet(10.0),
+        "Base Media": plate_sheet("M9"),
+        "Inhibitor": plate_sheet("None"),
+        "Inhibitor Conc": plate_sheet(0),
+        "Comments": plate_sheet("None"),
+    }
+    with pd.ExcelWriter(join(plate_dir, "combined_metadata.xlsx")) as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=sheet_name != "Metadata")
+
+    wells = [row + str(c) for row in rows for c in cols]
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.uniform(0, 1, (n_timepoints, len(wells))), columns=wells)
+    # Time as fraction of days, as written by the Bioreader
+    data.insert(0, "Time", np.arange(n_timepoints) * 10 / 60 / 24)
+    data.to_excel(join(plate_dir, "data.xlsx"), index=False)
+
+
+def benchmark_plate(data_dir, project, plate_name):
+    logger = getLogger("benchmark")
+    timings = {}
+    start = perf_counter()
+    sheets = parse_data.load_workbook(data_dir, project, plate_name)
+    meta = parse_data.parse_meta_data(sheets, project, plate_name, logger)
+    parse_data.parse_technical_data(sheets, project, plate_name, logger)
+    timings["metadata"] = perf_counter() - start
+    start = perf_counter()
+    raw = parse_data.parse_raw_data(join(data_dir, project, plate_name), logger)
+    timings["raw data"] = perf_counter() - start
+    start = perf_counter()
+    parse_data.parse_meta_to_df(meta, raw, project, plate_name)
+    timings["tables"] = perf_counter() - start
+    timings["total"] = sum(timings.values())
+    return timings
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark of the plate ingest.")
+    parser.add_argument("--timepoints", type=int, default=200)
+    args = parser.parse_args()
+
+    results = {}
+    with TemporaryDirectory() as data_dir:
+        for n_wells, (n_rows, n_cols) in PLATE_FORMATS.items():
+            plate_name = "plate_" + str(n_wells)
+            write_plate(
+                join(data_dir, "benchmark", plate_name),
+                n_rows,
+                n_cols,
+                args.timepoints,
+            )
+            results[str(n_wells) + " wells"] = benchmark_plate(
+                data_dir, "benchmark", plate_name
+            )
+    print(pd.DataFrame(results).T.round(3).to_string())
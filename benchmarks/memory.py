@@ -0,0 +1,55 @@
+from os.path import dirname, abspath, join
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from multiprocessing import get_context
+import sys
+import pandas as pd
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from benchmarks.metadata import pooled_metadata
+from pages.metadata import load_metadata
+
+# Memory of the pooled metadata in a dashboard worker, read as plain object
+# columns and with the schema of load_metadata. Every loader runs in a fresh
+# process, RSS is read from /proc and therefore only reported on Linux.
+# Usage: python benchmarks/memory.py [--wells N]
+
+LOADERS = {"object columns": pd.read_csv, "schema": load_metadata}
+
+
+def rss_mb():
+    with open("/proc/self/status") as handle:
+        for line in handle:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def measure(task):
+    # The Data viewer and the Fitting page each hold their own copy.
+    name, path = task
+    before = rss_mb()
+    copies = [LOADERS[name](path) for page in ["viewer", "fitting"]]
+    return {
+        "RSS before (MB)": before,
+        "RSS after (MB)": rss_mb(),
+        "DataFrame (MB)": copies[0].memory_usage(deep=True).sum() / 1024**2,
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Memory of the pooled metadata.")
+    parser.add_argument("--wells", type=int, default=200000)
+    args = parser.parse_args()
+
+    results = {}
+    with TemporaryDirectory() as directory:
+        path = join(directory, "pooled_df_joint_metadata.csv")
+        pooled_metadata(args.wells).to_csv(path, index=False)
+        context = get_context("spawn")
+        for name in LOADERS:
+            with context.Pool(1) as pool:
+                results[name] = pool.map(measure, [(name, path)])[0]
+    results = pd.DataFrame(results).T
+    results["RSS growth (MB)"] = results["RSS after (MB)"] - results["RSS before (MB)"]
+    print(results.round(1).to_string())
@@ -0,0 +1,80 @@
+from os.path import dirname, abspath, join
+from argparse import ArgumentParser
+from time import perf_counter
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from pages.metadata import MetadataIndex
+
+# Time of the metadata selections of the Data viewer on the pooled metadata
+# repeated to the given number of wells, with masks over the table and with
+# the MetadataIndex.
+# Usage: python benchmarks/metadata.py [--wells N]
+
+
+def pooled_metadata(n_wells):
+    # Copies of the pooled metadata as separate projects.
+    df = pd.read_csv(join("metadata", "pooled_df_joint_metadata.csv"))
+    copies = []
+    for copy in range(int(np.ceil(n_wells / len(df)))):
+        df_copy = df.copy()
+        for column in ["project", "exp_ID", "linegroup"]:
+            df_copy[column] = df_copy[column] + "_" + str(copy)
+        copies.append(df_copy)
+    return pd.concat(copies, ignore_index=True).iloc[:n_wells]
+
+
+def select_masks(df, projects, carbon_sources, species):
+    return df[
+        (df["species"].isin(species))
+        & (df["carbon_source"].isin(carbon_sources))
+        & (df["project"].isin(projects))
+    ]
+
+
+def dropdown_masks(df, projects):
+    df = df[df["project"].isin(projects)]
+    return sorted(set(df["carbon_source"])), sorted(set(df["species"]))
+
+
+def timed(function, *args, repeats=20):
+    start = perf_counter()
+    for i in range(repeats):
+        function(*args)
+    return (perf_counter() - start) / repeats * 1000
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark of the metadata selections.")
+    parser.add_argument("--wells", type=int, default=200000)
+    args = parser.parse_args()
+
+    df = pooled_metadata(args.wells)
+    start = perf_counter()
+    index = MetadataIndex(df)
+    build = perf_counter() - start
+    projects = list(df["project"].unique()[:2])
+    carbon_sources = list(df["carbon_source"].unique()[:3])
+    species = ["All"]
+    all_species = list(df["species"].unique())
+    results = {
+        "masks": {
+            "select (ms)": timed(
+                select_masks, df, projects, carbon_sources, all_species
+            ),
+            "dropdowns (ms)": timed(dropdown_masks, df, projects),
+        },
+        "index": {
+            "select (ms)": timed(index.select, projects, carbon_sources, species),
+            "dropdowns (ms)": timed(
+                lambda: (
+                    index.values("carbon_source", projects),
+                    index.values("species", projects),
+                )
+            ),
+        },
+    }
+    print("index built in {:.2f} s for {} wells".format(build, len(df)))
+    print(pd.DataFrame(results).T.round(3).to_string())
@@ -0,0 +1,73 @@
+from os.path import dirname, abspath
+from argparse import ArgumentParser
+from time import perf_counter
+import sys
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from pages import utils
+from pages.measurements import MeasurementIndex
+
+# Size and time of the figure of the Data viewer for long runs, with all
+# timepoints and decimated to the point budget of a graph.
+# Usage: python benchmarks/viewer.py [--linegroups N] [--timepoints N]
+
+
+def synthetic_selection(n_linegroups, n_timepoints, replicates=3):
+    # Metadata and measurements of one species on a series of concentrations.
+    rng = np.random.default_rng(0)
+    t = np.linspace(0, 72, n_timepoints)
+    metadata = pd.DataFrame(
+        {
+            "linegroup": ["lg" + str(i) for i in range(n_linegroups)],
+            "project": "benchmark",
+            "exp_ID": "plate",
+            "Experimenter": "Benchmark",
+            "species": "Species",
+            "carbon_source": "Glucose",
+            "cs_conc": np.arange(n_linegroups) // replicates,
+        }
+    )
+    measurements = pd.DataFrame(
+        {
+            "linegroup": np.repeat(metadata["linegroup"], n_timepoints),
+            "time": np.tile(t, n_linegroups),
+            "measurement": np.tile(1 / (1 + np.exp(10 - t / 3)), n_linegroups)
+            + rng.normal(0, 1e-2, n_linegroups * n_timepoints),
+        }
+    )
+    return metadata, MeasurementIndex(measurements.merge(metadata, on="linegroup"))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark of the viewer figure.")
+    parser.add_argument("--linegroups", type=int, default=30)
+    parser.add_argument("--timepoints", type=int, default=20000)
+    parser.add_argument("--graph-width", type=int, default=1000)
+    args = parser.parse_args()
+
+    metadata, measurement_index = synthetic_selection(args.linegroups, args.timepoints)
+    budgets = {"all points": None, "decimated": utils.point_budget(args.graph_width)}
+    results = {}
+    for plot_replicates, curves in [(["replicates"], "replicates"), (None, "mean")]:
+        for name, max_points in budgets.items():
+            start = perf_counter()
+            fig = utils.plot_data(
+                measurement_index,
+                metadata,
+                "Carbon Source",
+                plot_replicates,
+                ["spread"],
+                "linear-scale",
+                go.Layout(),
+                max_points,
+            )
+            payload = fig.to_json()
+            results[curves + ", " + name] = {
+                "points": sum(len(trace.x) for trace in fig.data),
+                "payload (MB)": len(payload) / 1024**2,
+                "time (s)": perf_counter() - start,
+            }
+    print(pd.DataFrame(results).T.round(3).to_string())
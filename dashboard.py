@@ -1,14 +1,27 @@
 import dash
-from dash import html
+from dash import html, DiskcacheManager
 import dash_bootstrap_components as dbc
+import diskcache
+from os import environ
 from os.path import join
+from pages.metadata import metadata_service
+from pages.watcher import export_watcher
+
+# Fitting runs as background callback in a separate process, jobs and their
+# progress are exchanged through a local diskcache set with CURVES_JOB_CACHE.
+background_callback_manager = DiskcacheManager(
+    diskcache.Cache(environ.get("CURVES_JOB_CACHE", "cache"))
+)
 
 app = dash.Dash(
     __name__,
     use_pages=True,
+    background_callback_manager=background_callback_manager,
     external_stylesheets=[dbc.themes.BOOTSTRAP, join("assets", "style_new.css")],
 )
 server = app.server
+# Loaded at import, with gunicorn's preload_app before the workers are forked
+metadata_service.current()
 sidebar = dbc.Nav(
     [
         dbc.NavLink(
@@ -46,4 +59,5 @@ app.layout = dbc.Container(
 
 
 if __name__ == "__main__":
+    export_watcher.start()
     app.run(debug=True)
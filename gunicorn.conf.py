@@ -0,0 +1,21 @@
+import gc
+
+# Settings of gunicorn, read from the working directory when the dashboard is
+# served with: gunicorn dashboard:server
+
+# The app and the pooled metadata are loaded once in the master process and
+# shared copy-on-write by the forked workers.
+preload_app = True
+
+
+def when_ready(server):
+    # Objects of the preloaded app are excluded from garbage collection, so
+    # collections in the workers do not write to and copy their memory pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Picks up new ingests in every worker, see pages/watcher.py
+    from pages.watcher import export_watcher
+
+    export_watcher.start()
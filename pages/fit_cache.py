@@ -0,0 +1,117 @@
+import sqlite3
+import pickle
+import json
+from hashlib import sha256
+from os import environ, makedirs
+from os.path import dirname, exists, join
+from time import time
+
+# Results of the Fitting page, stored in SQLite so they are shared between
+# gunicorn workers and survive restarts. A result is keyed by a fingerprint of
+# the fitted data and the fitting parameters, so changed exports are refitted.
+
+# Location of the database is set with CURVES_FIT_CACHE, empty disables caching.
+FIT_CACHE = environ.get("CURVES_FIT_CACHE", "export/fit_cache.sqlite")
+# Size of the stored results in MB, set with CURVES_FIT_CACHE_MB. The oldest
+# results are dropped once it is exceeded.
+FIT_CACHE_MB = int(environ.get("CURVES_FIT_CACHE_MB", 256))
+# Fits precomputed at ingest with parse_data.py --fit, stored per project.
+PROJECT_FIT_STORE = "fit_results.sqlite"
+
+
+def data_fingerprint(measurement_index, concentrations, lg_replicates):
+    # Hash of the linegroups, concentrations and measurements of a species and
+    # carbon source combination.
+    digest = sha256()
+    for conc, lgs in zip(concentrations, lg_replicates):
+        digest.update(repr(float(conc)).encode())
+        for lg in lgs:
+            digest.update(lg.encode())
+            digest.update(measurement_index.get(lg, "time").tobytes())
+            digest.update(measurement_index.get(lg, "measurement").tobytes())
+    return digest.hexdigest()
+
+
+def fit_key(fingerprint, **parameters):
+    return sha256(
+        json.dumps([fingerprint, parameters], sort_keys=True).encode()
+    ).hexdigest()
+
+
+class FitCache:
+    def __init__(self, path, track_used=False, size_limit=None):
+        self.path = path
+        # Bytes of pickled results kept, None keeps all of them.
+        self.size_limit = size_limit
+        # Keys read or written through this instance, see prune. Only tracked
+        # for stores which are pruned, a long-running cache would keep every
+        # key it ever served.
+        self.used = set() if track_used else None
+
+    def connect(self):
+        makedirs(dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS fits "
+            "(key TEXT PRIMARY KEY, result BLOB, created REAL)"
+        )
+        return connection
+
+    def get(self, key):
+        if not self.path or not exists(self.path):
+            return None
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT result FROM fits WHERE key = ?", (key,)
+            ).fetchone()
+        connection.close()
+        if row is None:
+            return None
+        if self.used is not None:
+            self.used.add(key)
+        return pickle.loads(row[0])
+
+    def put(self, key, result):
+        if not self.path:
+            return
+        if self.used is not None:
+            self.used.add(key)
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO fits VALUES (?, ?, ?)",
+                (key, pickle.dumps(result), time()),
+            )
+            if self.size_limit is not None:
+                self.evict(connection)
+        connection.close()
+
+    def evict(self, connection):
+        # Removes the oldest results which do not fit into size_limit together
+        # with the newer ones.
+        connection.execute(
+            "DELETE FROM fits WHERE key IN (SELECT key FROM "
+            "(SELECT key, SUM(LENGTH(result)) OVER (ORDER BY created DESC) AS total "
+            "FROM fits) WHERE total > ?)",
+            (self.size_limit,),
+        )
+
+    def prune(self):
+        # Removes all results which were not used through this instance.
+        if self.used is None:
+            raise ValueError("prune needs a FitCache created with track_used")
+        if not self.path or not exists(self.path):
+            return 0
+        with self.connect() as connection:
+            keys = [row[0] for row in connection.execute("SELECT key FROM fits")]
+            unused = [(key,) for key in keys if key not in self.used]
+            connection.executemany("DELETE FROM fits WHERE key = ?", unused)
+        connection.close()
+        return len(unused)
+
+
+fit_cache = FitCache(FIT_CACHE, size_limit=FIT_CACHE_MB * 1024 * 1024)
+
+
+def project_store(parsed_data_dir, project):
+    return FitCache(join(parsed_data_dir, project, PROJECT_FIT_STORE), track_used=True)
@@ -1,5 +1,13 @@
 import dash
-from dash import dcc, html, callback, Output, Input, State, no_update
+from dash import (
+    dcc,
+    html,
+    callback,
+    clientside_callback,
+    Output,
+    Input,
+    State,
+)
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 import pandas as pd
@@ -7,6 +15,9 @@ import zipfile
 from io import BytesIO
 from . import utils
 from . import fitting_utils
+from .measurements import MeasurementIndex
+from .fit_cache import project_store
+from .metadata import metadata_service
 
 
 # Dash layout
@@ -14,79 +25,116 @@ dash.register_page(
     __name__, path="/Fitting", name="Fitting", order=2
 )  # '/' is home page
 
-pooled_df_joint_metadata = pd.read_csv("metadata/pooled_df_joint_metadata.csv")
-projects, cs, species = utils.load_dropdown_data(pooled_df_joint_metadata)
-
 
-layout = html.Div(
-    [
-        dbc.Col(
-            [
-                dbc.Row(
-                    html.Span("Select projects and conditions:"), class_name="pb-1"
-                ),
-                dbc.Row(
-                    dcc.Dropdown(
-                        options=projects,
-                        placeholder="Select Project",
-                        id="proj-dropdown",
-                        multi=True,
+# Built on every page load, so newly ingested projects are listed.
+def layout(**kwargs):
+    metadata_index = metadata_service.current()
+    return html.Div(
+        [
+            dbc.Col(
+                [
+                    dbc.Row(
+                        html.Span("Select projects and conditions:"), class_name="pb-1"
                     ),
-                    class_name="pb-1",
-                ),
-                dbc.Row(
-                    dcc.Dropdown(
-                        options=cs,
-                        placeholder="Select Carbon Source",
-                        id="cs-dropdown",
-                        multi=True,
+                    dbc.Row(
+                        dcc.Dropdown(
+                            options=metadata_index.projects,
+                            placeholder="Select Project",
+                            id="proj-dropdown",
+                            multi=True,
+                        ),
+                        class_name="pb-1",
                     ),
-                    class_name="pb-1",
-                ),
+                    dbc.Row(
+                        dcc.Dropdown(
+                            options=metadata_index.cs,
+                            placeholder="Select Carbon Source",
+                            id="cs-dropdown",
+                            multi=True,
+                        ),
+                        class_name="pb-1",
+                    ),
+                    dbc.Row(
+                        dcc.Dropdown(
+                            options=metadata_index.species,
+                            placeholder="Select Species",
+                            id="species-dropdown",
+                            multi=True,
+                        ),
+                        class_name="pb-1",
+                    ),
+                ],
+                width=6,
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        [
+                            dbc.Button("Fit Parameters", id="fitting-button"),
+                        ],
+                        width="auto",
+                        class_name="pt-3",
+                    ),
+                    dbc.Col(
+                        [
+                            dbc.Button(
+                                "Cancel",
+                                id="cancel-fitting-button",
+                                color="secondary",
+                                disabled=True,
+                            ),
+                        ],
+                        width="auto",
+                        class_name="pt-3",
+                    ),
+                    dbc.Col(
+                        dbc.Progress(
+                            id="fitting-progress",
+                            value=0,
+                            style={"visibility": "hidden"},
+                        ),
+                        width=4,
+                        class_name="pt-4",
+                    ),
+                ]
+            ),
+            dbc.Col(
                 dbc.Row(
-                    dcc.Dropdown(
-                        options=species,
-                        placeholder="Select Species",
-                        id="species-dropdown",
-                        multi=True,
+                    dbc.Collapse(
+                        id="parameters-table",
+                        class_name="data-table",
+                        is_open=False,
+                        children=[
+                            html.Div(id="parameters-table-final"),
+                            # Groups fitted so far while fitting is running,
+                            # kept if fitting is cancelled
+                            html.Div(id="parameters-table-partial"),
+                            dcc.Store(id="parameters-table-progress"),
+                        ],
                     ),
-                    class_name="pb-1",
-                ),
-            ],
-            width=6,
-        ),
-        dbc.Row(
-            [
-                dbc.Col(
-                    [
-                        dbc.Button("Fit Parameters", id="fitting-button"),
-                    ],
-                    width="auto",
                     class_name="pt-3",
                 ),
-            ]
-        ),
-        dbc.Col(
-            dbc.Row(
-                dbc.Collapse(
-                    id="parameters-table",
-                    class_name="data-table",
-                    is_open=False,
-                    children=[],
-                ),
-                class_name="pt-3",
+                width=12,
             ),
-            width=12,
-        ),
-    ]
+        ]
+    )
+
+
+# Shown in place of the final table if fitting is cancelled, a finished fit
+# replaces it with its table.
+CANCELLED = dbc.Alert(
+    "Fitting was cancelled, only the groups fitted until then are shown.",
+    color="warning",
 )
 
 
-# Callback for fitting
+# Callback for fitting, runs as background job so fitting does not block the
+# server. Fitted groups are streamed into the table through the progress.
 @callback(
     [
-        Output(component_id="parameters-table", component_property="children"),
+        Output(component_id="parameters-table-final", component_property="children"),
         Output(component_id="parameters-table", component_property="is_open"),
+        Output("parameters-table-partial", "children", allow_duplicate=True),
     ],
     [
         State(component_id="proj-dropdown", component_property="value"),
@@ -94,11 +142,38 @@ layout = html.Div(
         State(component_id="species-dropdown", component_property="value"),
         Input("fitting-button", "n_clicks"),
     ],
+    background=True,
+    running=[
+        (Output("fitting-button", "disabled"), True, False),
+        (Output("parameters-table", "is_open"), True, True),
+        (Output("parameters-table-final", "children"), None, CANCELLED),
+        (Output("cancel-fitting-button", "disabled"), False, True),
+        (
+            Output("fitting-progress", "style"),
+            {"visibility": "visible"},
+            {"visibility": "hidden"},
+        ),
+        (
+            Output("parameters-table-final", "style"),
+            {"display": "none"},
+            {"display": "block"},
+        ),
+    ],
+    cancel=[Input("cancel-fitting-button", "n_clicks")],
+    progress=[
+        Output("fitting-progress", "value"),
+        Output("fitting-progress", "max"),
+        Output("fitting-progress", "label"),
+        Output("parameters-table-progress", "data"),
+    ],
+    progress_default=[0, 1, "", None],
     prevent_initial_call=True,
 )
-def fit_parameters(chosen_projects, chosen_carbon_sources, chosen_species, nclicks):
+def fit_parameters(
+    set_progress, chosen_projects, chosen_carbon_sources, chosen_species, nclicks
+):
     if nclicks == 0 or nclicks is None:
-        return no_update, False
+        return None, False, None
     if (
         chosen_projects == "Select Project"
         or chosen_projects == None
@@ -107,21 +182,67 @@ def fit_parameters(chosen_projects, chosen_carbon_sources, chosen_species, nclic
         or chosen_species == "Select Species"
         or chosen_species == None
     ):
-        return no_update, False
+        return None, False, None
 
-    args = projects[1:], species, cs, pooled_df_joint_metadata, "export"
+    metadata_index = metadata_service.current()
+    args = (
+        metadata_index.projects[1:],
+        metadata_index.species,
+        metadata_index.cs,
+        metadata_index,
+        "export",
+    )
     filtered_metadata = utils.load_selected_metadata(
         chosen_projects, chosen_carbon_sources, chosen_species, args
     )
     if len(filtered_metadata) == 0:
-        return dbc.Alert(
-            "No data found for the selected conditions", color="warning"
-        ), True
+        return (
+            dbc.Alert("No data found for the selected conditions", color="warning"),
+            True,
+            None,
+        )
 
     parsed_data_dir = "export"
     df_merged = utils.load_data_from_metadata(filtered_metadata, args)
 
-    df_restructured = utils.export_restructuring(df_merged, filtered_metadata)
-    parameters_table = fitting_utils.table_generator(df_restructured, filtered_metadata)
+    measurement_index = MeasurementIndex(df_merged)
+    # Rows of a previously cancelled fit are removed
+    set_progress((0, 1, "", []))
+
+    def report_progress(n_finished, n_groups, partial_table):
+        set_progress(
+            (
+                n_finished,
+                n_groups,
+                str(n_finished) + " / " + str(n_groups),
+                partial_table,
+            )
+        )
 
-    return parameters_table, True
+    # Fits precomputed at ingest are used for groups within one project
+    precomputed = [
+        project_store(parsed_data_dir, project)
+        for project in filtered_metadata["project"].unique()
+    ]
+    parameters_table = fitting_utils.table_generator(
+        measurement_index,
+        filtered_metadata,
+        set_progress=report_progress,
+        precomputed=precomputed,
+    )
+
+    return parameters_table, True, None
+
+
+# Copies the rows streamed by fit_parameters into the table. The progress is
+# reset to None once fitting stops, the rows are then kept so a cancelled fit
+# still shows them. A finished fit removes them itself.
+clientside_callback(
+    """
+    function(rows) {
+        return rows == null ? window.dash_clientside.no_update : rows;
+    }
+    """,
+    Output("parameters-table-partial", "children"),
+    Input("parameters-table-progress", "data"),
+)
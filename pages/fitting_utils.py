@@ -9,10 +9,32 @@ from scipy.integrate import odeint
 # import emcee
 import pandas as pd
 from scipy.ndimage import gaussian_filter1d
-from dash import html
+from dash import html, dcc
 import dash_bootstrap_components as dbc
+import plotly.graph_objects as go
 import base64
 from io import BytesIO
+from os import environ
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .fit_cache import fit_cache, data_fingerprint, fit_key
+
+# Number of processes used for fitting, set with CURVES_FIT_WORKERS. Every
+# gunicorn worker starts its own pool, so only a single process is used unless
+# the operator opts in to more.
+FIT_WORKERS = int(environ.get("CURVES_FIT_WORKERS", 1))
+# Seed of the random starts, fits of the same data are reproducible.
+FIT_SEED = 0
+# Random starts of every fit.
+FIT_RANDOM_STARTS = 10
+# Solver of the Monod model used for fitting, set with CURVES_FIT_SOLVER.
+# "odeint" integrates the ODE, "closed_form" solves its implicit solution and
+# "rk45" integrates all concentrations at once with an adaptive Runge-Kutta.
+FIT_SOLVER = environ.get("CURVES_FIT_SOLVER", "odeint")
+# Figures of the parameters table, set with CURVES_FIT_FIGURES. "plotly" sends
+# decimated plotly figures, "png" matplotlib images embedded as base64.
+FIT_FIGURES = environ.get("CURVES_FIT_FIGURES", "plotly")
+# Points per trace of the plotly figures.
+FIGURE_POINTS = 200
 
 
 def restructure_metadata_fitting(df_metadata):
@@ -75,23 +97,276 @@ def get_yield(measurement, c0):
 
 def monod(y, t, v, Km, q):
     n, c = y
+    # Division by zero and invalid values raise a FloatingPointError
     with np.errstate(divide="raise", invalid="raise"):
-        try:
-            dndt = v * c / (Km + c) * n
-            dcdt = -v * c / (Km + c) * n / q
-        except FloatingPointError:
-            print(v, Km, n, c, t)
-            # np.save("bad_params", [v,Km])
-            dndt = v * c / (Km + c) * n
-            dcdt = -v * c / (Km + c) * n / q
+        dndt = v * c / (Km + c) * n
+        dcdt = -v * c / (Km + c) * n / q
 
     return np.array([dndt, dcdt])
 
 
+def monod_jacobian(y, t, v, Km, q):
+    # Jacobian of monod, passed to odeint as Dfun.
+    n, c = y
+    dn_dn = v * c / (Km + c)
+    dn_dc = v * n * Km / (Km + c) ** 2
+    return np.array([[dn_dn, dn_dc], [-dn_dn / q, -dn_dc / q]])
+
+
+def monod_sensitivity(y, t, Km, q):
+    # Dimensionless monod (v = 1) extended by s, the derivative of n by Km.
+    # c = 1 - (n - 1) / q, so the derivative of c by Km is -s / q.
+    n, c, s = y
+    d = Km + c
+    dn_dn = c / d
+    dn_dc = n * Km / d**2
+    dn_dKm = -c * n / d**2
+    return np.array([c / d * n, -c / d * n / q, (dn_dn - dn_dc / q) * s + dn_dKm])
+
+
+def monod_sensitivity_jacobian(y, t, Km, q):
+    # Jacobian of monod_sensitivity, passed to odeint as Dfun.
+    n, c, s = y
+    d = Km + c
+    dn_dn = c / d
+    dn_dc = n * Km / d**2
+    ds_dn = -Km / d**2 * s / q - c / d**2
+    ds_dc = (Km / d**2 + 2 * n * Km / d**3 / q) * s + n * (c - Km) / d**3
+    return np.array(
+        [
+            [dn_dn, dn_dc, 0],
+            [-dn_dn / q, -dn_dc / q, 0],
+            [ds_dn, ds_dc, dn_dn - dn_dc / q],
+        ]
+    )
+
+
+def solve_monod(tau, Km, q, iterations=64):
+    # Biomass of the dimensionless batch Monod model, n(0) = c(0) = 1 and
+    # dn/dtau = c / (Km + c) * n with c = 1 - (n - 1) / q. Time is an explicit
+    # function of biomass, tau = (1 + a) ln(n) - a ln(c) with a = Km q / (1 + q),
+    # which is solved for n on [1, 1 + q] with a bisection over all points.
+    tau, Km, q = np.broadcast_arrays(
+        np.asarray(tau, dtype=float),
+        np.asarray(Km, dtype=float),
+        np.asarray(q, dtype=float),
+    )
+    a = Km * q / (1 + q)
+    low = np.ones(tau.shape)
+    high = 1 + q
+    for i in range(iterations):
+        n = (low + high) / 2
+        c = np.maximum(1 - (n - 1) / q, np.finfo(float).tiny)
+        above = (1 + a) * np.log(n) - a * np.log(c) > tau
+        high = np.where(above, n, high)
+        low = np.where(above, low, n)
+    return (low + high) / 2
+
+
+# Dormand-Prince 5(4) tableau for integrate_monod, ERROR is the difference of
+# the weights of the 5th and 4th order solutions.
+DP_A = [
+    np.array(weights)
+    for weights in [
+        [],
+        [1 / 5],
+        [3 / 40, 9 / 40],
+        [44 / 45, -56 / 15, 32 / 9],
+        [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+        [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+        [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+    ]
+]
+DP_ERROR = np.array(
+    [71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40]
+)
+
+
+def integrate_monod(tau, Km, q, rtol=1e-6, atol=1e-9, sensitivity=False):
+    # Integrates the dimensionless batch Monod model (see solve_monod) for
+    # every row of tau at once, d ln(n) / dtau = c / (Km + c). All rows are
+    # stepped together with an adaptive Dormand-Prince scheme and the values at
+    # the timepoints of every row are interpolated with cubic Hermite splines.
+    # With sensitivity the derivative of n by Km is integrated alongside and
+    # returned as second value.
+    tau = np.atleast_2d(np.asarray(tau, dtype=float))
+    n_rows = tau.shape[0]
+    Km = np.broadcast_to(np.asarray(Km, dtype=float), (n_rows,))
+    q = np.broadcast_to(np.asarray(q, dtype=float), (n_rows,))
+    tiny = np.finfo(float).tiny
+
+    def rate(state):
+        # State is ln(n) of all rows, followed by d ln(n) / dKm if requested.
+        log_n = state[:n_rows]
+        c = np.maximum(1 - np.expm1(log_n) / q, 0)
+        d = np.maximum(Km + c, tiny)
+        if not sensitivity:
+            return c / d
+        dc_dlog_n = np.where(c > 0, -np.exp(log_n) / q, 0)
+        log_n_Km = state[n_rows:]
+        return np.concatenate(
+            [c / d, Km / d**2 * dc_dlog_n * log_n_Km - c / d**2]
+        )
+
+    end = np.max(tau)
+    position = 0.0
+    state = np.zeros(n_rows * (2 if sensitivity else 1))
+    slope = rate(state)
+    h = 0.1
+    min_step = 1e-12 * max(end, 1.0)
+    positions, values, slopes = [position], [state], [slope]
+    stages = np.empty((len(DP_A), len(state)))
+    while position < end:
+        h = min(h, end - position)
+        stages[0] = slope
+        for i in range(1, len(DP_A)):
+            # The last stage is evaluated at the 5th order solution
+            step_state = state + h * (DP_A[i] @ stages[:i])
+            stages[i] = rate(step_state)
+        # The step size is only controlled by the error of ln(n)
+        error = h * np.abs(DP_ERROR @ stages[:, :n_rows])
+        tolerance = atol + rtol * np.maximum(
+            np.abs(state[:n_rows]), np.abs(step_state[:n_rows])
+        )
+        error_ratio = np.max(error / tolerance)
+        if not np.isfinite(error_ratio) or (error_ratio > 1 and h < min_step):
+            # Rates are not finite (e.g. q = 0) or the step size vanished, the
+            # model can not be integrated with these parameters.
+            n = np.full(tau.shape, np.nan)
+            if sensitivity:
+                return n, n.copy()
+            return n
+        if error_ratio <= 1:
+            position += h
+            state, slope = step_state, stages[-1].copy()
+            positions.append(position)
+            values.append(state)
+            slopes.append(slope)
+        h *= min(5, max(0.2, 0.9 * max(error_ratio, 1e-10) ** -0.2))
+
+    # Cubic Hermite interpolation within the step of every timepoint
+    if len(positions) == 1:
+        state_out = np.zeros((len(state),) + tau.shape[1:])
+    else:
+        state_tau = np.tile(tau, (len(state) // n_rows, 1))
+        positions = np.array(positions)
+        values = np.array(values).T
+        slopes = np.array(slopes).T
+        step = np.clip(
+            np.searchsorted(positions, state_tau, side="right") - 1,
+            0,
+            len(positions) - 2,
+        )
+        rows = np.arange(len(state))[:, None]
+        h = positions[step + 1] - positions[step]
+        theta = (state_tau - positions[step]) / h
+        state_out = (
+            (2 * theta**3 - 3 * theta**2 + 1) * values[rows, step]
+            + (theta**3 - 2 * theta**2 + theta) * h * slopes[rows, step]
+            + (-2 * theta**3 + 3 * theta**2) * values[rows, step + 1]
+            + (theta**3 - theta**2) * h * slopes[rows, step + 1]
+        )
+    n = np.exp(state_out[:n_rows])
+    if sensitivity:
+        return n, n * state_out[n_rows:]
+    return n
+
+
+def pad_rows(rows):
+    # Stacks arrays of different length into a matrix, shorter rows are padded
+    # with their last value.
+    lengths = np.array([len(row) for row in rows])
+    matrix = np.empty((len(rows), lengths.max()))
+    for i, row in enumerate(rows):
+        matrix[i, : len(row)] = row
+        matrix[i, len(row) :] = row[-1]
+    return matrix, lengths
+
+
+def monod_biomass(t, n0, c0, v, Km, q, solver=FIT_SOLVER):
+    # Biomass of the batch Monod model starting with n0 and c0 at t[0].
+    if solver == "odeint":
+        return odeint(monod, [n0, c0], t, args=(v, Km, q), Dfun=monod_jacobian)[:, 0]
+    if solver == "closed_form":
+        return n0 * solve_monod(v * (t - t[0]), Km / c0, q * c0 / n0)
+    if solver == "rk45":
+        return n0 * integrate_monod(v * (t - t[0]), Km / c0, q * c0 / n0)[0]
+    raise ValueError("Unknown solver: " + str(solver))
+
+
+def monod_biomass_sensitivity(tau, Km, q, solver=FIT_SOLVER):
+    # Dimensionless biomass (see solve_monod) and its derivative by Km for a
+    # list of time arrays with one Km and q each, concatenated over the arrays.
+    if solver == "odeint":
+        solutions = [
+            odeint(
+                monod_sensitivity,
+                [1, 1, 0],
+                tau_i,
+                args=(Km_i, q_i),
+                Dfun=monod_sensitivity_jacobian,
+            )
+            for tau_i, Km_i, q_i in zip(tau, Km, q)
+        ]
+        return (
+            np.concatenate([solution[:, 0] for solution in solutions]),
+            np.concatenate([solution[:, 2] for solution in solutions]),
+        )
+    if solver == "closed_form":
+        # Implicit differentiation of tau = (1 + a) ln(n) - a ln(c), the
+        # derivative of n by tau is the growth rate n c / (Km + c).
+        lengths = [len(tau_i) for tau_i in tau]
+        Km = np.repeat(Km, lengths)
+        q = np.repeat(q, lengths)
+        n = solve_monod(np.concatenate(tau), Km, q)
+        c = np.maximum(1 - (n - 1) / q, np.finfo(float).tiny)
+        dn_dKm = -q / (1 + q) * (np.log(n) - np.log(c)) * n * c / (Km + c)
+        return n, dn_dKm
+    if solver == "rk45":
+        tau, lengths = pad_rows(tau)
+        n, dn_dKm = integrate_monod(tau, Km, q, sensitivity=True)
+        valid = np.arange(tau.shape[1]) < lengths[:, None]
+        return n[valid], dn_dKm[valid]
+    raise ValueError("Unknown solver: " + str(solver))
+
+
+def monod_objective(params, t, q, n, c0, n0, solver=FIT_SOLVER):
+    # Error of simulate_monod together with its gradient by Km and v.
+    Km, v = params
+    c0, n0, q = np.asarray(c0), np.asarray(n0), np.asarray(q)
+    elapsed = [t_i - t_i[0] for t_i in t]
+    y, dy_dKm = monod_biomass_sensitivity(
+        [elapsed_i * v for elapsed_i in elapsed], Km / c0, q * c0 / n0, solver
+    )
+    lengths = [len(t_i) for t_i in t]
+    Km_scaled = np.repeat(Km / c0, lengths)
+    q_scaled = np.repeat(q * c0 / n0, lengths)
+    c = np.maximum(1 - (y - 1) / q_scaled, 0)
+    dy_dtau = y * c / (Km_scaled + c)
+    residual = np.concatenate([n_i / n0_i for n_i, n0_i in zip(n, n0)]) - y
+    gradient = -2 * np.array(
+        [
+            np.sum(residual * dy_dKm / np.repeat(c0, lengths)),
+            np.sum(residual * dy_dtau * np.concatenate(elapsed)),
+        ]
+    )
+    return np.sum(residual**2), gradient
+
+
+def monod_Km_objective(Km, args):
+    # Error of simulate_monod_Km together with its gradient by Km.
+    v, t, q, n, c0, n0, solver = args
+    y, dy_dKm = monod_biomass_sensitivity(
+        [v * (t - t[0])], [Km[0] / c0], [q * c0 / n0], solver
+    )
+    residual = n - n0 * y
+    return np.sum(residual**2), np.array([-2 * np.sum(residual * n0 * dy_dKm / c0)])
+
+
 def simulate_monod_Km(Km, args):
-    v, t, q, n, c0, n0 = args
-    y = odeint(monod, [n0, c0], t, args=(v, Km[0], q))
-    error = np.sum(((n) - (y[:, 0])) ** 2)
+    v, t, q, n, c0, n0, solver = args
+    y = monod_biomass(t, n0, c0, v, Km[0], q, solver)
+    error = np.sum(((n) - (y)) ** 2)
     return error
 
 
@@ -102,10 +377,14 @@ def get_Km(
     initial_n,
     est_growth_rate,
     total_yield,
+    rng=None,
+    solver=FIT_SOLVER,
 ):
+    if rng is None:
+        rng = np.random.default_rng()
     min_err = np.inf
     Km_best = 0
-    random_starts = 10
+    random_starts = FIT_RANDOM_STARTS
     args = [
         est_growth_rate,
         time_values,
@@ -113,14 +392,16 @@ def get_Km(
         measurement_values,
         initial_conc,
         initial_n,
+        solver,
     ]
     for i in range(random_starts):
-        random_Km = np.random.uniform(0, 20)
+        random_Km = rng.uniform(0, 20)
         minimization_trial = optimize.minimize(
-            simulate_monod_Km,
+            monod_Km_objective,
             random_Km,
             args=(args),
             bounds=((0, 1000),),
+            jac=True,
         )
         Km = minimization_trial.x
         err = minimization_trial.fun
@@ -130,8 +411,29 @@ def get_Km(
     return Km_best[0]
 
 
-def simulate_monod(params, t, q, n, c0, n0):
+def simulate_monod(params, t, q, n, c0, n0, solver=FIT_SOLVER):
     Km, v = params
+    if solver == "closed_form":
+        # All concentrations are solved at once on the concatenated timepoints.
+        lengths = [len(t_i) for t_i in t]
+        y = solve_monod(
+            np.concatenate([(t_i - t_i[0]) * v for t_i in t]),
+            np.repeat(Km / np.asarray(c0), lengths),
+            np.repeat(np.asarray(q) * np.asarray(c0) / np.asarray(n0), lengths),
+        )
+        n_scaled = np.concatenate([n_i / n0_i for n_i, n0_i in zip(n, n0)])
+        return np.sum((n_scaled - y) ** 2)
+    if solver == "rk45":
+        # All concentrations are integrated at once as rows of one matrix.
+        tau, lengths = pad_rows([(t_i - t_i[0]) * v for t_i in t])
+        y = integrate_monod(
+            tau,
+            Km / np.asarray(c0),
+            np.asarray(q) * np.asarray(c0) / np.asarray(n0),
+        )
+        n_scaled, _ = pad_rows([n_i / n0_i for n_i, n0_i in zip(n, n0)])
+        valid = np.arange(tau.shape[1]) < lengths[:, None]
+        return np.sum(((n_scaled - y) ** 2)[valid])
     error = 0
     for i in range(len(n)):
         # y = odeint(monod, [n0[i], c0[i]], t[i][argmins[i]:argmaxs[i]], args=(v, Km, q[i]))
@@ -141,38 +443,56 @@ def simulate_monod(params, t, q, n, c0, n0):
     return error
 
 
-def get_params(args, random_starts=10):
+def minimize_start(task):
+    # One random start of get_params, defined on module level so it can be
+    # run in a worker process.
+    start, args, bounds = task
+    minimization_trial = optimize.minimize(
+        monod_objective, start, args=args, bounds=bounds, jac=True
+    )
+    return minimization_trial.x, minimization_trial.fun
+
+
+def get_params(args, random_starts=10, rng=None, workers=1, solver=FIT_SOLVER):
     t, series, c0, n0, q, achieved_growth_rates = args
+    if rng is None:
+        rng = np.random.default_rng()
+    # Starts are drawn up front so the result does not depend on workers.
+    starts = [
+        [rng.uniform(0.001, 20), rng.uniform(0.05, 2)] for i in range(random_starts)
+    ]
+    bounds = ((1e-6, 1000), (np.max(achieved_growth_rates), 10))
+    tasks = [(start, (t, q, series, c0, n0, solver), bounds) for start in starts]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, random_starts)) as pool:
+            trials = list(pool.map(minimize_start, tasks))
+    else:
+        trials = list(map(minimize_start, tasks))
+
     min_err = np.inf
     Km_best, v_best = 0, 0
-    for i in range(random_starts):
-        random_Km, random_v = np.random.uniform(0.001, 20), np.random.uniform(0.05, 2)
-        minimization_trial = optimize.minimize(
-            simulate_monod,
-            [random_Km, random_v],
-            args=(t, q, series, c0, n0),
-            bounds=((1e-6, 1000), (np.max(achieved_growth_rates), 10)),
-        )
-        Km, v = minimization_trial.x
-        err = minimization_trial.fun
+    for (Km, v), err in trials:
         if err < min_err:
             min_err = err
             Km_best, v_best = Km, v
     return v_best, Km_best
 
 
-def log_likelohood(theta, args):
+def log_likelohood(theta, args, solver=FIT_SOLVER):
     t, series, c0, n0, q, argmins, argmaxs = args
     v, Km = theta
     error = 0
     for i in range(len(n0)):
-        y = odeint(
-            monod,
-            [1, c0[i] / Km],
+        y = monod_biomass(
             t[i][argmins[i] : argmaxs[i]] * v,
-            args=(1, 1, q[i] * Km / n0[i]),
+            1,
+            c0[i] / Km,
+            1,
+            1,
+            q[i] * Km / n0[i],
+            solver,
         )
-        error += np.sum(((series[i][argmins[i] : argmaxs[i]] / n0[i]) - (y[:, 0])) ** 2)
+        error += np.sum(((series[i][argmins[i] : argmaxs[i]] / n0[i]) - (y)) ** 2)
     return -error
 
 
@@ -190,17 +510,21 @@ def log_posterior(theta, args):
     return prior + log_likelohood(theta, args)
 
 
-def get_measurement_values(df_data, cur_lgs):
-    time_values = df_data[cur_lgs[0] + "_time"].to_numpy()
+def get_measurement_values(measurement_index, cur_lgs):
+    # Replicates are averaged over the timepoints all of them have.
+    replicates = [measurement_index.get(cur_lg, "measurement") for cur_lg in cur_lgs]
+    n_timepoints = min([len(replicate) for replicate in replicates])
+    time_values = measurement_index.get(cur_lgs[0], "time")[:n_timepoints]
     measurement_values = np.mean(
-        np.array([df_data[cur_lg + "_measurement"].to_numpy() for cur_lg in cur_lgs]),
-        axis=0,
+        np.array([replicate[:n_timepoints] for replicate in replicates]), axis=0
     )
     return time_values, measurement_values
 
 
-def preprocess_measurement(df_data, cur_lgs):
-    time_values, measurement_values = get_measurement_values(df_data, cur_lgs)
+def preprocess_measurement(measurement_index, cur_lgs):
+    time_values, measurement_values = get_measurement_values(
+        measurement_index, cur_lgs
+    )
 
     non_nan_time_index = np.where(~np.isnan(time_values))[0]
     time_values = time_values[non_nan_time_index]
@@ -255,7 +579,9 @@ def append_to_args(
     return args_dict
 
 
-def params_from_args(args_dict, run_samples):
+def params_from_args(
+    args_dict, run_samples, rng=None, workers=1, solver=FIT_SOLVER
+):
     t_array_run = [args_dict["t_array"][i] for i in run_samples]
     n_array_run = [args_dict["n_array"][i] for i in run_samples]
     c0_array_run = [args_dict["c0_array"][i] for i in run_samples]
@@ -274,7 +600,9 @@ def params_from_args(args_dict, run_samples):
 
     # fitting_method = "monod_fit" # "mcmc" , "monod_fit", "minimize", "inidividual"
 
-    v_est, Km_est = get_params(args, random_starts=10)
+    v_est, Km_est = get_params(
+        args, random_starts=FIT_RANDOM_STARTS, rng=rng, workers=workers, solver=solver
+    )
 
     # Km_est = []
     # for i in range(len(run_samples)):
@@ -306,60 +634,182 @@ def generate_run_samples(used_conc):
     return run_samples
 
 
-def main_fit_function(df_data, concentrations_present, lg_replicates, fitting_comments):
+def fit_group(task):
+    # Fits one species and carbon source combination, defined on module level
+    # so it can be run in a worker process.
+    method, args, seed, workers, solver = task
+    rng = np.random.default_rng(seed)
+    if method == "Km":
+        return get_Km(*args, rng=rng, solver=solver)
+    return params_from_args(*args, rng=rng, workers=workers, solver=solver)
+
+
+def run_fits(tasks, workers, solver, on_result):
+    # Groups are fitted in parallel if there are several, otherwise the random
+    # starts of the single group are. on_result is called with the index of the
+    # task and its result as soon as a group is fitted.
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            futures = {
+                pool.submit(fit_group, (method, args, seed, 1, solver)): index
+                for index, (method, args, seed) in enumerate(tasks)
+            }
+            for future in as_completed(futures):
+                on_result(futures[future], future.result())
+        return
+    for index, (method, args, seed) in enumerate(tasks):
+        on_result(index, fit_group((method, args, seed, workers, solver)))
+
+
+def simulate_group(method, prepared, fit_result, solver):
+    # Simulated curves, fitted values and comment of a fitted group.
+    if method == "Km":
+        cur_time, cur_measurement, cur_conc, cur_n0, cur_v_est, cur_yield = prepared
+        cur_Km_est = fit_result
+
+        cur_simulation = monod_biomass(
+            cur_time - cur_time[0],
+            cur_n0,
+            cur_conc,
+            cur_v_est,
+            cur_Km_est,
+            cur_yield,
+            solver,
+        )
+        simulation_df = pd.DataFrame({"time": cur_time, "measurement": cur_simulation})
+        return [simulation_df], [cur_v_est, cur_Km_est], "Single concentration fit."
+
+    args_dict, used_conc, concNum = prepared
+    v_est, Km_est = fit_result
+    df_cs_fit = []
+    for k in range(concNum):
+        if k not in used_conc:
+            df_cs_fit.append([])
+            continue
+        position = used_conc.index(k)
+
+        simulated_df = pd.DataFrame(
+            {
+                "time": args_dict["t_array"][position],
+                "measurement": monod_biomass(
+                    args_dict["t_array"][position] - args_dict["t_array"][position][0],
+                    args_dict["n0_array"][position],
+                    args_dict["c0_array"][position],
+                    v_est,
+                    Km_est,
+                    args_dict["yield_array"][position],
+                    solver,
+                ),
+            }
+        )
+
+        df_cs_fit.append(simulated_df)
+    return df_cs_fit, [v_est, Km_est], ""
+
+
+def grown(measurement_values):
+    # Series without data or which stay below an OD of 0.05 are not fitted.
+    return len(measurement_values) > 0 and np.max(measurement_values) >= 0.05
+
+
+def main_fit_function(
+    measurement_index,
+    concentrations_present,
+    lg_replicates,
+    fitting_comments,
+    workers=FIT_WORKERS,
+    seed=FIT_SEED,
+    solver=FIT_SOLVER,
+    on_group=None,
+    precomputed=(),
+    cache=fit_cache,
+):
+    # on_group is called for every species and carbon source combination with
+    # data once it is done, with its result (None if it was not fitted), the
+    # number of finished and the total number of groups.
+    # Results are looked up in the precomputed fit stores and then in cache,
+    # new results are stored in cache.
     dfs_fitted = []
     fit_values = []
-
+    n_groups = sum(
+        len(lg_conc_replicates) > 0
+        for lg_sp_replicates in lg_replicates
+        for lg_conc_replicates in lg_sp_replicates
+    )
+    finished = []
+
+    def report(group):
+        finished.append(group)
+        if on_group is not None:
+            on_group(*group, group_results.get(group), len(finished), n_groups)
+
+    # Groups are looked up in the fit cache, the data of the remaining groups
+    # is prepared first and then all of them are fitted.
+    group_results = {}
+    tasks = []
+    prepared = {}
+    keys = {}
     spNum = len(lg_replicates)
     for i in range(spNum):
-        df_sp_fit = []
-        val_sp_fit = []
         csNum = len(lg_replicates[i])
         for j in range(csNum):
-            df_cs_fit = []
             concNum = len(lg_replicates[i][j])
-
             if concNum == 0:
-                df_sp_fit.append([])
-                val_sp_fit.append([])
+                continue
 
-            elif concNum == 1:
+            method = "Km" if concNum == 1 else "monod"
+            yield_fraction = 0.02 if concNum == 1 else 0.05
+            fingerprint = data_fingerprint(
+                measurement_index, concentrations_present[i][j], lg_replicates[i][j]
+            )
+            key = fit_key(
+                fingerprint,
+                method=method,
+                yield_fraction=yield_fraction,
+                solver=solver,
+                random_starts=FIT_RANDOM_STARTS,
+                seed=seed,
+            )
+            cached = None
+            for store in list(precomputed) + [cache]:
+                cached = store.get(key)
+                if cached is not None:
+                    break
+            if cached is not None:
+                group_results[(i, j)] = cached
+                report((i, j))
+                continue
+            # The seed of a group only depends on its data, so cached and new
+            # fits agree whichever other groups are selected.
+            group_seed = np.random.SeedSequence([seed, int(fingerprint[:16], 16)])
+
+            if concNum == 1:
                 original_conc = concentrations_present[i][j][0]
                 cur_lgs = lg_replicates[i][j][0]
 
                 time_values, measurement_values = preprocess_measurement(
-                    df_data, cur_lgs
+                    measurement_index, cur_lgs
                 )
 
-                if np.max(measurement_values) < 0.05:
-                    df_sp_fit.append([])
-                    val_sp_fit.append([])
+                if not grown(measurement_values):
+                    report((i, j))
                     continue
 
-                yield_fraction = 0.02
                 cur_time, cur_measurement, cur_conc, cur_n0, cur_yield = get_args(
                     time_values, measurement_values, original_conc, yield_fraction
                 )
 
                 cur_v_est = est_vmax(cur_time, cur_measurement)
-                cur_Km_est = get_Km(
-                    cur_time, cur_measurement, cur_conc, cur_n0, cur_v_est, cur_yield
+                args = (
+                    cur_time,
+                    cur_measurement,
+                    cur_conc,
+                    cur_n0,
+                    cur_v_est,
+                    cur_yield,
                 )
-
-                cur_simulation = odeint(
-                    monod,
-                    [cur_n0, cur_conc],
-                    cur_time - cur_time[0],
-                    args=(cur_v_est, cur_Km_est, cur_yield),
-                )
-                simulation_df = pd.DataFrame(
-                    {"time": cur_time, "measurement": cur_simulation[:, 0]}
-                )
-
-                df_sp_fit.append([simulation_df])
-                val_sp_fit.append([cur_v_est, cur_Km_est])
-
-                fitting_comments[i][j] += "Single concentration fit."
+                prepared[(i, j)] = args
+                tasks.append((method, args, group_seed))
 
             elif concNum > 1:
                 args_dict = {
@@ -376,12 +826,11 @@ def main_fit_function(df_data, concentrations_present, lg_replicates, fitting_co
                     cur_lgs = lg_replicates[i][j][k]
 
                     time_values, measurement_values = preprocess_measurement(
-                        df_data, cur_lgs
+                        measurement_index, cur_lgs
                     )
-                    if np.max(measurement_values) < 0.05:
+                    if not grown(measurement_values):
                         continue
                     used_conc.append(k)
-                    yield_fraction = 0.05
                     args_dict = append_to_args(
                         args_dict,
                         time_values,
@@ -390,31 +839,44 @@ def main_fit_function(df_data, concentrations_present, lg_replicates, fitting_co
                         yield_fraction,
                     )
 
-                # run_samples = generate_run_samples(used_conc)
-                run_samples = used_conc
-                v_est, Km_est = params_from_args(args_dict, run_samples)
-
-                for k in range(concNum):
-                    if k not in used_conc:
-                        df_cs_fit.append([])
-                        continue
+                # No concentration grew, like a single concentration below the
+                # threshold the group is not fitted.
+                if len(used_conc) == 0:
+                    report((i, j))
+                    continue
 
-                    simulated_df = pd.DataFrame(
-                        {
-                            "time": args_dict["t_array"][k],
-                            "measurement": odeint(
-                                monod,
-                                [args_dict["n0_array"][k], args_dict["c0_array"][k]],
-                                args_dict["t_array"][k] - args_dict["t_array"][k][0],
-                                args=(v_est, Km_est, args_dict["yield_array"][k]),
-                            )[:, 0],
-                        }
-                    )
+                # run_samples = generate_run_samples(used_conc)
+                # The args of the used concentrations are stored in order
+                run_samples = list(range(len(used_conc)))
+                prepared[(i, j)] = (args_dict, used_conc, concNum)
+                tasks.append((method, (args_dict, run_samples), group_seed))
+            keys[(i, j)] = key
+
+    groups = list(prepared)
+
+    def finish_group(index, fit_result):
+        group = groups[index]
+        group_results[group] = simulate_group(
+            tasks[index][0], prepared[group], fit_result, solver
+        )
+        cache.put(keys[group], group_results[group])
+        report(group)
 
-                    df_cs_fit.append(simulated_df)
+    run_fits(tasks, workers, solver, finish_group)
 
-                df_sp_fit.append(df_cs_fit)
-                val_sp_fit.append([v_est, Km_est])
+    for i in range(spNum):
+        df_sp_fit = []
+        val_sp_fit = []
+        csNum = len(lg_replicates[i])
+        for j in range(csNum):
+            if (i, j) not in group_results:
+                df_sp_fit.append([])
+                val_sp_fit.append([])
+                continue
+            df_cs_fit, values, comment = group_results[(i, j)]
+            df_sp_fit.append(df_cs_fit)
+            val_sp_fit.append(values)
+            fitting_comments[i][j] += comment
         dfs_fitted.append(df_sp_fit)
         fit_values.append(val_sp_fit)
 
@@ -430,7 +892,7 @@ def fig_to_base64(fig):
     return fig_bar_matplotlib
 
 
-def generate_figure(df_data, cur_df, concentrations, linegroups):
+def generate_figure(measurement_index, cur_df, concentrations, linegroups):
     color_conc = ["C1", "C3", "C5", "C7", "C9", "C2", "C4", "C6", "C8", "C0"]
     fig, ax = plt.subplots(figsize=(10, 6))
     skipped_conc = 0
@@ -440,12 +902,8 @@ def generate_figure(df_data, cur_df, concentrations, linegroups):
         if len(cur_df[k]) == 0:
             skipped_conc += 1
             continue
-        time_values = df_data[cur_lgs[0] + "_time"].to_numpy()
-        measurement_values = np.mean(
-            np.array(
-                [df_data[cur_lg + "_measurement"].to_numpy() for cur_lg in cur_lgs]
-            ),
-            axis=0,
+        time_values, measurement_values = get_measurement_values(
+            measurement_index, cur_lgs
         )
 
         actual_k = k - skipped_conc
@@ -473,17 +931,100 @@ def generate_figure(df_data, cur_df, concentrations, linegroups):
     return fig_to_base64(fig)
 
 
-def table_generator(df_data, df_metadata):
-    (
-        species_selected,
-        carbon_source_selected,
-        concentrations_present,
-        lg_replicates,
-        fitting_comments,
-    ) = restructure_metadata_fitting(df_metadata)
-    dfs_fitted, fit_values, fitting_comments = main_fit_function(
-        df_data, concentrations_present, lg_replicates, fitting_comments
+def decimate(x, y, max_points):
+    # Every n-th point so at most max_points remain, the last point is kept.
+    x, y = np.asarray(x), np.asarray(y)
+    if len(x) <= max_points:
+        return x, y
+    index = np.unique(
+        np.append(np.arange(0, len(x), int(np.ceil(len(x) / max_points))), len(x) - 1)
+    )
+    return x[index], y[index]
+
+
+def generate_plotly_figure(measurement_index, cur_df, concentrations, linegroups):
+    # Same plot as generate_figure with decimated traces, sent as data instead
+    # of an image and rendered by the browser.
+    # Colors of the matplotlib cycle used by generate_figure
+    color_conc = [
+        "#ff7f0e",
+        "#d62728",
+        "#8c564b",
+        "#7f7f7f",
+        "#17becf",
+        "#2ca02c",
+        "#9467bd",
+        "#e377c2",
+        "#bcbd22",
+        "#1f77b4",
+    ]
+    fig = go.Figure()
+    skipped_conc = 0
+    for k in range(len(concentrations)):
+        cur_conc = concentrations[k]
+        cur_lgs = linegroups[k]
+        if len(cur_df[k]) == 0:
+            skipped_conc += 1
+            continue
+        time_values, measurement_values = get_measurement_values(
+            measurement_index, cur_lgs
+        )
+
+        actual_k = k - skipped_conc
+        color = color_conc[actual_k % len(color_conc)]
+        time_values, measurement_values = decimate(
+            time_values, measurement_values, FIGURE_POINTS
+        )
+        fit_time, fit_measurement = decimate(
+            cur_df[actual_k]["time"], cur_df[actual_k]["measurement"], FIGURE_POINTS
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=np.round(time_values, 3),
+                y=np.round(measurement_values, 4),
+                mode="lines",
+                line=dict(color=color, width=1),
+                showlegend=False,
+                hoverinfo="skip",
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=np.round(fit_time, 3),
+                y=np.round(fit_measurement, 4),
+                mode="lines",
+                line=dict(color=color, dash="dash"),
+                name="{:.3f}".format(cur_conc),
+            )
+        )
+
+    fig.update_layout(
+        template="simple_white",
+        margin=dict(l=40, r=10, t=10, b=35),
+        xaxis=dict(title="Time (h)", rangemode="tozero"),
+        yaxis=dict(title="OD600"),
+        legend=dict(x=1, y=0, xanchor="right", yanchor="bottom"),
     )
+    return fig
+
+
+def figure_cell(measurement_index, cur_df, concentrations, linegroups):
+    # Figure of a row in the parameters table.
+    if FIT_FIGURES == "png":
+        fig_base64 = generate_figure(
+            measurement_index, cur_df, concentrations, linegroups
+        )
+        return html.Img(src=fig_base64, style={"width": "20vw"})
+    return dcc.Graph(
+        figure=generate_plotly_figure(
+            measurement_index, cur_df, concentrations, linegroups
+        ),
+        config={"displayModeBar": False},
+        style={"width": "20vw", "height": "12vw"},
+    )
+
+
+def parameters_table(rows):
     table_header = [
         html.Thead(
             html.Tr(
@@ -498,46 +1039,69 @@ def table_generator(df_data, df_metadata):
             )
         )
     ]
+    table = dbc.Table(
+        table_header + rows, bordered=True, striped=True, hover=True, responsive=True
+    )
+    return table
 
-    for i in range(len(species_selected)):
-        cur_species = species_selected[i]
-        for j in range(len(carbon_source_selected)):
-            cur_cs = carbon_source_selected[j]
-            if len(concentrations_present[i][j]) == 0:
-                continue
 
-            else:
-                cur_df = dfs_fitted[i][j]
-                if len(cur_df) == 0:
-                    continue
-                vmax_table, Km_table = (
-                    np.round(fit_values[i][j][0], 3),
-                    np.round(fit_values[i][j][1], 3),
-                )
-                comments = fitting_comments[i][j]
-                fig_base64 = generate_figure(
-                    df_data, cur_df, concentrations_present[i][j], lg_replicates[i][j]
-                )
+def table_generator(measurement_index, df_metadata, set_progress=None, precomputed=()):
+    # Fits all selected species and carbon sources. Rows are added as soon as
+    # their group is fitted, set_progress is called with the number of finished
+    # groups, the total number of groups and the table of the finished ones.
+    # Results precomputed at ingest are used if the data of a group matches.
+    (
+        species_selected,
+        carbon_source_selected,
+        concentrations_present,
+        lg_replicates,
+        fitting_comments,
+    ) = restructure_metadata_fitting(df_metadata)
+    rows = {}
+
+    def add_row(i, j, group_result, n_finished, n_groups):
+        if group_result is not None and len(group_result[0]) > 0:
+            cur_df, fit_values, comment = group_result
+            vmax_table, Km_table = (
+                np.round(fit_values[0], 3),
+                np.round(fit_values[1], 3),
+            )
+            # Comments of the fit are only added to fitting_comments once all
+            # groups are done.
+            comments = fitting_comments[i][j] + comment
+            figure = figure_cell(
+                measurement_index,
+                cur_df,
+                concentrations_present[i][j],
+                lg_replicates[i][j],
+            )
 
-                table_header.append(
-                    html.Tbody(
-                        html.Tr(
-                            [
-                                html.Td(cur_species),
-                                html.Td(cur_cs),
-                                html.Td(vmax_table),
-                                html.Td(Km_table),
-                                html.Td(
-                                    html.Img(src=fig_base64, style={"width": "20vw"})
-                                ),
-                                html.Td(comments),
-                            ]
-                        )
-                    )
+            rows[(i, j)] = html.Tbody(
+                html.Tr(
+                    [
+                        html.Td(species_selected[i]),
+                        html.Td(carbon_source_selected[j]),
+                        html.Td(vmax_table),
+                        html.Td(Km_table),
+                        html.Td(figure),
+                        html.Td(comments),
+                    ]
                 )
+            )
+        if set_progress is not None:
+            set_progress(
+                n_finished,
+                n_groups,
+                parameters_table([rows[group] for group in sorted(rows)]),
+            )
 
-    table = dbc.Table(
-        table_header, bordered=True, striped=True, hover=True, responsive=True
+    main_fit_function(
+        measurement_index,
+        concentrations_present,
+        lg_replicates,
+        fitting_comments,
+        on_group=add_row,
+        precomputed=precomputed,
     )
 
-    return table
+    return parameters_table([rows[group] for group in sorted(rows)])
@@ -0,0 +1,239 @@
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+from os import environ, scandir, stat, remove, rmdir, listdir, getpid
+from os.path import join, exists, dirname
+from shutil import rmtree
+from collections import OrderedDict
+from threading import Lock
+
+# Storage of the parsed time series. Every project is stored as a parquet
+# dataset which is partitioned by exp_ID, so a plate can be read or replaced
+# without touching the other plates of the project.
+
+MEASUREMENT_DATASET = "measurement_data.parquet"
+MEASUREMENT_CSV = "measurement_data.csv"
+
+# linegroup is dictionary encoded, every linegroup name is only stored once
+# per file instead of once per timepoint.
+MEASUREMENT_SCHEMA = pa.schema(
+    [
+        ("exp_ID", pa.string()),
+        ("linegroup", pa.dictionary(pa.int32(), pa.string())),
+        ("time", pa.float64()),
+        ("measurement", pa.float64()),
+    ]
+)
+
+
+def write_measurements(df_measurement, save_folder, replaced_exp_IDs=None):
+    # Writes the measurements of a project. By default all previously exported
+    # data is replaced, otherwise only the plates in replaced_exp_IDs.
+    dataset = join(save_folder, MEASUREMENT_DATASET)
+    if replaced_exp_IDs is None:
+        if exists(dataset):
+            rmtree(dataset)
+    elif exists(dataset):
+        delete_partitions(dataset, replaced_exp_IDs)
+    if len(df_measurement) == 0:
+        return
+    table = pa.Table.from_pandas(
+        df_measurement[MEASUREMENT_SCHEMA.names],
+        schema=MEASUREMENT_SCHEMA,
+        preserve_index=False,
+    )
+    pq.write_to_dataset(
+        table,
+        dataset,
+        partition_cols=["exp_ID"],
+        existing_data_behavior="delete_matching",
+    )
+
+
+def delete_partitions(dataset, exp_IDs):
+    # Removes the files of the given plates from the dataset.
+    partitions = ds.dataset(dataset, format="parquet", partitioning="hive")
+    for fragment in partitions.get_fragments(
+        filter=ds.field("exp_ID").isin(list(exp_IDs))
+    ):
+        remove(fragment.path)
+        if len(listdir(dirname(fragment.path))) == 0:
+            rmdir(dirname(fragment.path))
+
+
+def read_measurements(parsed_data_dir, project, exp_IDs=None, linegroups=None):
+    # Reads the measurements of a project. If exp_IDs or linegroups are passed
+    # only the matching partitions and row groups are read from disk.
+    dataset = join(parsed_data_dir, project, MEASUREMENT_DATASET)
+    if not exists(dataset):
+        # Projects exported before the parquet store only have the csv table.
+        df = pd.read_csv(join(parsed_data_dir, project, MEASUREMENT_CSV))
+        if linegroups is not None:
+            df = df[df["linegroup"].isin(linegroups)]
+        return df[["linegroup", "time", "measurement"]]
+
+    filters = []
+    if exp_IDs is not None:
+        filters.append(("exp_ID", "in", list(exp_IDs)))
+    if linegroups is not None:
+        filters.append(("linegroup", "in", list(linegroups)))
+    table = pq.read_table(
+        dataset,
+        columns=["linegroup", "time", "measurement"],
+        filters=filters if len(filters) > 0 else None,
+        memory_map=True,
+    )
+    return table.to_pandas()
+
+
+def export_mtime(parsed_data_dir, project):
+    # Latest modification time of the exported measurements of a project.
+    # Replacing a plate changes the mtime of its partition directory.
+    dataset = join(parsed_data_dir, project, MEASUREMENT_DATASET)
+    if not exists(dataset):
+        return stat(join(parsed_data_dir, project, MEASUREMENT_CSV)).st_mtime_ns
+    mtimes = [stat(dataset).st_mtime_ns]
+    for entry in scandir(dataset):
+        mtimes.append(entry.stat().st_mtime_ns)
+    return max(mtimes)
+
+
+class MeasurementCache:
+    # Keeps the measurements of recently used projects in memory. Entries are
+    # keyed by project and the mtime of its export, once max_bytes is exceeded
+    # the least recently used projects are evicted.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        # Process in which an ExportWatcher invalidates changed projects, the
+        # exports are then not checked on every get.
+        self.watched_pid = None
+
+    def get(self, parsed_data_dir, project):
+        key = (parsed_data_dir, project)
+        with self.lock:
+            if self.watched_pid == getpid() and key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][1]
+        mtime = export_mtime(parsed_data_dir, project)
+        with self.lock:
+            if key in self.entries and self.entries[key][0] == mtime:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][1]
+            self.misses += 1
+        df = read_measurements(parsed_data_dir, project)
+        self.put(key, mtime, df)
+        return df
+
+    def put(self, key, mtime, df):
+        n_bytes = int(df.memory_usage(deep=True).sum())
+        with self.lock:
+            self.pop(key)
+            if n_bytes > self.max_bytes:
+                return
+            self.entries[key] = (mtime, df, n_bytes)
+            self.n_bytes += n_bytes
+            while self.n_bytes > self.max_bytes:
+                self.pop(next(iter(self.entries)))
+
+    def pop(self, key):
+        if key in self.entries:
+            self.n_bytes -= self.entries.pop(key)[2]
+
+    def invalidate_changed(self):
+        # Drops the projects whose export changed since they were read.
+        with self.lock:
+            keys = list(self.entries)
+        changed = []
+        for key in keys:
+            try:
+                mtime = export_mtime(*key)
+            except FileNotFoundError:
+                mtime = None
+            with self.lock:
+                if key in self.entries and self.entries[key][0] != mtime:
+                    self.pop(key)
+                    changed.append(key[1])
+        return changed
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "projects": [project for _, project in self.entries],
+                "bytes": self.n_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# The budget is set in MB with CURVES_MEASUREMENT_CACHE_MB, 0 disables caching.
+measurement_cache = MeasurementCache(
+    int(environ.get("CURVES_MEASUREMENT_CACHE_MB", 512)) * 1024 * 1024
+)
+
+
+def load_measurements(parsed_data_dir, project, exp_IDs, linegroups):
+    # Measurements of the selected linegroups, served from memory if possible.
+    if measurement_cache.max_bytes == 0:
+        return read_measurements(parsed_data_dir, project, exp_IDs, linegroups)
+    df = measurement_cache.get(parsed_data_dir, project)
+    return df[df["linegroup"].isin(linegroups)]
+
+
+class MeasurementIndex:
+    # Measurements sorted by linegroup and time with an offset table, the rows
+    # of a linegroup are a contiguous slice of every column.
+    def __init__(self, df):
+        self.df = df.sort_values(by=["linegroup", "time"], kind="stable")
+        codes, linegroups = pd.factorize(self.df["linegroup"])
+        starts = np.flatnonzero(np.diff(codes, prepend=-1))
+        stops = np.append(starts[1:], len(codes))
+        self.offsets = {
+            linegroups[code]: (start, stop)
+            for code, start, stop in zip(codes[starts], starts, stops)
+        }
+        self.columns = {}
+
+    def __contains__(self, linegroup):
+        return linegroup in self.offsets
+
+    def linegroups(self):
+        return list(self.offsets.keys())
+
+    def get(self, linegroup, column):
+        # Values of the column for one linegroup, empty if it has no data.
+        start, stop = self.offsets.get(linegroup, (0, 0))
+        return self.get_column(column)[start:stop]
+
+    def first(self, linegroup, column):
+        return self.get(linegroup, column)[0]
+
+    def matrix(self, linegroups, column):
+        # (linegroup x timepoint) matrix of the column, shorter series are
+        # padded with NaN.
+        offsets = np.array(
+            [self.offsets.get(lg, (0, 0)) for lg in linegroups], dtype=int
+        ).reshape(-1, 2)
+        lengths = offsets[:, 1] - offsets[:, 0]
+        rows = np.repeat(np.arange(len(linegroups)), lengths)
+        timepoints = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        positions = np.repeat(offsets[:, 0], lengths) + timepoints
+        values = np.full((len(linegroups), max(lengths.max(initial=0), 1)), np.nan)
+        values[rows, timepoints] = self.get_column(column)[positions]
+        return values
+
+    def get_column(self, column):
+        if column not in self.columns:
+            self.columns[column] = self.df[column].to_numpy()
+        return self.columns[column]
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+from os import stat
+from os.path import join
+from threading import Lock
+from . import utils
+from .measurements import measurement_cache
+
+# Index over the pooled metadata for the selections of the Data viewer and the
+# Fitting page. The rows of every project, species and carbon source are kept
+# as sorted arrays of row positions (posting lists), so a selection is a union
+# and intersection of a few arrays instead of masks over the whole table.
+
+INDEXED_COLUMNS = ["project", "species", "carbon_source"]
+
+METADATA_CSV = join("metadata", "pooled_df_joint_metadata.csv")
+# Columns which repeat the same few values for every well are categoricals,
+# each value is stored once and the wells hold integer codes. Every well has
+# its own linegroup, it is stored as one Arrow string buffer instead of a
+# Python string per well.
+CATEGORICAL_COLUMNS = [
+    "project",
+    "exp_ID",
+    "Experimenter",
+    "Experiment description",
+    "Date",
+    "Device",
+    "Shaking",
+    "CO2",
+    "species",
+    "carbon_source",
+    "base_media",
+    "inhibitor",
+    "comments",
+]
+METADATA_DTYPES = dict(
+    {column: "category" for column in CATEGORICAL_COLUMNS},
+    linegroup="string[pyarrow]",
+)
+
+
+def load_metadata(path=METADATA_CSV):
+    return pd.read_csv(path, dtype=METADATA_DTYPES)
+
+
+class MetadataIndex:
+    def __init__(self, df):
+        self.df = df
+        # Options of the project, carbon source and species dropdowns
+        self.projects, self.cs, self.species = utils.load_dropdown_data(df)
+        self.postings = {
+            column: df.groupby(column, sort=False, observed=True).indices
+            for column in INDEXED_COLUMNS
+        }
+        # Species and carbon sources of every project for the dropdowns
+        self.project_values = {
+            column: {
+                project: set(df[column].iloc[rows])
+                for project, rows in self.postings["project"].items()
+            }
+            for column in INDEXED_COLUMNS
+        }
+
+    def rows(self, column, values):
+        # Positions of the rows with one of the values, None for "All".
+        if "All" in values:
+            return None
+        postings = [self.postings[column].get(value) for value in values]
+        postings = [rows for rows in postings if rows is not None]
+        if len(postings) == 0:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate(postings))
+
+    def select(self, projects, carbon_sources, species):
+        # Metadata of the selected projects, carbon sources and species in the
+        # order of the pooled table.
+        selected = None
+        chosen = [projects, species, carbon_sources]
+        for column, values in zip(INDEXED_COLUMNS, chosen):
+            rows = self.rows(column, values)
+            if rows is None:
+                continue
+            if selected is None:
+                selected = rows
+            else:
+                selected = np.intersect1d(selected, rows, assume_unique=True)
+        if selected is None:
+            selected = np.arange(len(self.df))
+        return self.df.iloc[selected]
+
+    def select_linegroups(self, linegroups):
+        # Metadata of the linegroups in the order of the pooled table.
+        return self.df[self.df["linegroup"].isin(linegroups)]
+
+    def values(self, column, projects=None):
+        # Sorted values of the column, within the given projects if passed.
+        if projects is None:
+            return sorted(self.postings[column].keys())
+        return sorted(
+            set().union(
+                *[self.project_values[column].get(project, ()) for project in projects]
+            )
+        )
+
+
+class MetadataService:
+    # The pooled metadata shared by all pages of a process. It is loaded once,
+    # and again by current once the file was changed by an ingest. With
+    # gunicorn's preload_app it is loaded before the workers are forked.
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.index = None
+        self.lock = Lock()
+
+    def current(self):
+        # Index of the latest pooled metadata.
+        mtime = stat(self.path).st_mtime_ns
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    self.reload(mtime)
+        return self.index
+
+    def reload(self, mtime=None):
+        if mtime is None:
+            mtime = stat(self.path).st_mtime_ns
+        index = MetadataIndex(load_metadata(self.path))
+        # An ingest writes the exports before the pooled metadata, measurements
+        # cached before it are dropped so the new index is not paired with them.
+        measurement_cache.invalidate_changed()
+        self.index = index
+        self.mtime = mtime
+
+
+metadata_service = MetadataService(METADATA_CSV)
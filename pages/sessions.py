@@ -0,0 +1,31 @@
+import diskcache
+from os import environ
+
+# Selections of the Data viewer per browser session. Every page load gets a
+# session id in a dcc.Store, the selected linegroups are stored under it in a
+# local diskcache, which is shared by the gunicorn workers and bounded in size
+# by evicting the least recently used sessions.
+
+# Location and size in MB set with CURVES_SESSION_CACHE(_MB), next to and not
+# within the job cache of dashboard.py
+SESSION_CACHE = environ.get("CURVES_SESSION_CACHE", "cache-sessions")
+SESSION_CACHE_MB = int(environ.get("CURVES_SESSION_CACHE_MB", 64))
+# Sessions are dropped a day after their last selection
+SESSION_EXPIRE = 24 * 3600
+
+session_cache = diskcache.Cache(
+    SESSION_CACHE,
+    size_limit=SESSION_CACHE_MB * 1024 * 1024,
+    eviction_policy="least-recently-used",
+)
+
+
+def save_selection(session_id, linegroups):
+    session_cache.set(("viewer", session_id), list(linegroups), expire=SESSION_EXPIRE)
+
+
+def load_selection(session_id):
+    # Linegroups of the last selection of the session, None if there is none.
+    if session_id is None:
+        return None
+    return session_cache.get(("viewer", session_id))
@@ -1,12 +1,20 @@
 import pandas as pd
 import numpy as np
+from os import environ
 from os.path import join
 import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 from dash import html, dcc
+from . import measurements
 
 # Helper functions
 
+# Points per pixel of graph width sent for every trace of the viewer, set with
+# CURVES_PLOT_POINTS_PER_PIXEL. Longer traces are decimated, 0 disables it.
+PLOT_POINTS_PER_PIXEL = float(environ.get("CURVES_PLOT_POINTS_PER_PIXEL", 2))
+# Graph width assumed before the browser reported it.
+DEFAULT_GRAPH_WIDTH = 1000
+
 
 def load_dropdown_data(pooled_df_joint_metadata):
     cs = list(set(pooled_df_joint_metadata["carbon_source"]))
@@ -22,40 +30,28 @@ def load_dropdown_data(pooled_df_joint_metadata):
 
 
 def load_selected_metadata(proj_chosen, chosen_carbon_sources, chosen_species, args):
-    parsed_projects, species, cs, pooled_df_joint_metadata, parsed_data_dir = args
-    if "All" in proj_chosen:
-        proj_chosen = parsed_projects.copy()
-    if "All" in chosen_carbon_sources:
-        chosen_carbon_sources = cs[1:]
-    if "All" in chosen_species:
-        chosen_species = species[1:]
-
-    # Filter metadata based on selected carbon sources and species
-    filtered_metadata = pooled_df_joint_metadata[
-        (pooled_df_joint_metadata["species"].isin(chosen_species))
-        & (pooled_df_joint_metadata["carbon_source"].isin(chosen_carbon_sources))
-        & (pooled_df_joint_metadata["project"].isin(proj_chosen))
-    ]
-    return filtered_metadata
+    parsed_projects, species, cs, metadata_index, parsed_data_dir = args
+    # Filter metadata based on selected projects, carbon sources and species
+    return metadata_index.select(proj_chosen, chosen_carbon_sources, chosen_species)
 
 
 def load_data_from_metadata(filtered_metadata, args):
-    parsed_projects, species, cs, pooled_df_joint_metadata, parsed_data_dir = args
-
-    # Obtain the relevant linegroups from the filtered metadata
-    common_lg = filtered_metadata["linegroup"].unique()
-
-    # Choose projects based on linegroups
-    projects_common = pooled_df_joint_metadata[
-        pooled_df_joint_metadata["linegroup"].isin(common_lg)
-    ]["project"].unique()
+    parsed_projects, species, cs, metadata_index, parsed_data_dir = args
 
-    # Load only selected projects
+    # Load only selected projects, plates and linegroups
     dfs = []
-    for project in projects_common:
-        dfs.append(pd.read_csv(join(parsed_data_dir, project, "measurement_data.csv")))
+    for project in filtered_metadata["project"].unique():
+        project_metadata = filtered_metadata[filtered_metadata["project"] == project]
+        dfs.append(
+            measurements.load_measurements(
+                parsed_data_dir,
+                project,
+                exp_IDs=project_metadata["exp_ID"].unique(),
+                linegroups=project_metadata["linegroup"].unique(),
+            )
+        )
     df_data = pd.concat(dfs)
-    df_data = df_data[df_data["linegroup"].isin(common_lg)].sort_values(by="time").drop_duplicates()
+    df_data = df_data.sort_values(by="time").drop_duplicates()
 
     # Merge the measurement data with the filtered metadata to include carbon source and species info
     df_merged = df_data.merge(filtered_metadata, on="linegroup")
@@ -108,9 +104,132 @@ def restructure_metadata(df_metadata):
     )
 
 
+def aggregate_replicates(measurement_index, filtered_metadata, interpolate=True):
+    # Mean, standard deviation and standard error of the replicates of every
+    # (project, species, carbon_source, cs_conc) group. All linegroups are
+    # pivoted into one (linegroup x timepoint) matrix and aggregated with a
+    # single groupby.
+    keys = ["project", "species", "carbon_source", "cs_conc"]
+    metadata = filtered_metadata.drop_duplicates("linegroup")
+    metadata = metadata[metadata["linegroup"].isin(measurement_index.linegroups())]
+    # Wells with a missing key are never looked up, restructure_metadata
+    # matches the keys with ==, so they are not aggregated.
+    metadata = metadata.dropna(subset=keys)
+    linegroups = metadata["linegroup"].to_numpy()
+    time = measurement_index.matrix(linegroups, "time")
+    measurement = measurement_index.matrix(linegroups, "measurement")
+
+    # Group of every linegroup, observed=True since the categorical metadata
+    # holds all values of the pooled metadata.
+    codes = metadata.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+    # Row of the first replicate of every group, its time grid is the
+    # reference of the group.
+    first_rows = np.unique(codes, return_index=True)[1]
+    reference_time = time[first_rows[codes]]
+    if interpolate:
+        # Replicates sampled at different timepoints are interpolated onto
+        # the time grid of the first replicate. Padding is only matched by
+        # padding, a replicate longer than the first one is interpolated.
+        mismatched = ~np.all(np.isclose(time, reference_time, equal_nan=True), axis=1)
+        for row in np.flatnonzero(mismatched):
+            present = ~np.isnan(time[row])
+            measurement[row] = np.interp(
+                reference_time[row],
+                time[row][present],
+                measurement[row][present],
+                left=np.nan,
+                right=np.nan,
+            )
+
+    grouped = pd.DataFrame(measurement).groupby(codes)
+    mean = grouped.mean().to_numpy()
+    std = grouped.std().to_numpy()
+    n = grouped.count().to_numpy()
+    reference_time = time[first_rows]
+    groups = metadata[keys].iloc[first_rows].itertuples(index=False, name=None)
+
+    aggregated = {}
+    for row, group in enumerate(groups):
+        # Columns past the end of the first replicate are not part of its grid
+        present = (n[row] > 0) & ~np.isnan(reference_time[row])
+        aggregated[group] = {
+            "time": reference_time[row][present],
+            "mean": mean[row][present],
+            "std": std[row][present],
+            "sem": std[row][present] / np.sqrt(n[row][present]),
+            "n": n[row][present],
+        }
+    return aggregated
+
+
+def point_budget(graph_width):
+    # Points per trace for a graph of graph_width pixels, None keeps all.
+    if PLOT_POINTS_PER_PIXEL <= 0:
+        return None
+    return int(PLOT_POINTS_PER_PIXEL * (graph_width or DEFAULT_GRAPH_WIDTH))
+
+
+def minmax_indices(values, max_points):
+    # Indices of the smallest and largest value in max_points / 2 buckets of
+    # consecutive points plus the first and last point, so peaks and dips
+    # survive the decimation.
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    n_buckets = max(max_points // 2, 1)
+    bucket = np.arange(n) * n_buckets // n
+    # Sorted by bucket and within a bucket by increasing and decreasing value,
+    # NaN last in both, the first point of a bucket is its minimum or maximum.
+    ascending = np.lexsort((values, bucket))
+    descending = np.lexsort((-values, bucket))
+    starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+    return np.unique(
+        np.concatenate([ascending[starts], descending[starts], [0, n - 1]])
+    )
+
+
+def plot_indices(time, values, max_points, x_range=None):
+    # Points of a trace which are sent to the browser. With x_range, the
+    # visible part is decimated separately so zooming in shows more detail.
+    if max_points is None:
+        return np.arange(len(time))
+    indices = minmax_indices(values, max_points)
+    if x_range is not None:
+        start = max(np.searchsorted(time, x_range[0]) - 1, 0)
+        stop = min(np.searchsorted(time, x_range[1], side="right") + 1, len(time))
+        visible = start + minmax_indices(values[start:stop], max_points)
+        indices = np.union1d(indices, visible)
+    return indices
+
+
+def relayout_x_range(relayout_data):
+    # Range of the x-axis after a zoom or pan of a graph. Returns None if the
+    # range was reset and False if the x-axis did not change.
+    if relayout_data is None:
+        return False
+    if "xaxis.range[0]" in relayout_data and "xaxis.range[1]" in relayout_data:
+        return relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]
+    if "xaxis.range" in relayout_data:
+        return tuple(relayout_data["xaxis.range"])
+    if relayout_data.get("xaxis.autorange"):
+        return None
+    return False
+
+
 def add_trace(
-    fig, cur_time, cur_measurement, color_dict, legendgroup, name, hovertext, showlegend
+    fig,
+    cur_time,
+    cur_measurement,
+    color_dict,
+    legendgroup,
+    name,
+    hovertext,
+    showlegend,
+    max_points=None,
+    x_range=None,
 ):
+    indices = plot_indices(cur_time, cur_measurement, max_points, x_range)
+    cur_time, cur_measurement = cur_time[indices], cur_measurement[indices]
     fig.add_trace(
         go.Scatter(
             x=cur_time,
@@ -126,6 +245,37 @@ def add_trace(
     )
 
 
+def add_band(
+    fig,
+    cur_time,
+    lower,
+    upper,
+    color_dict,
+    legendgroup,
+    max_points=None,
+    x_range=None,
+):
+    # Filled area between lower and upper, drawn behind the mean trace
+    indices = np.union1d(
+        plot_indices(cur_time, lower, max_points, x_range),
+        plot_indices(cur_time, upper, max_points, x_range),
+    )
+    cur_time, lower, upper = cur_time[indices], lower[indices], upper[indices]
+    fig.add_trace(
+        go.Scatter(
+            x=np.concatenate([cur_time, cur_time[::-1]]),
+            y=np.concatenate([upper, lower[::-1]]),
+            mode="lines",
+            fill="toself",
+            line={"color": color_dict["color"], "width": 0},
+            opacity=0.2,
+            legendgroup=legendgroup,
+            hoverinfo="skip",
+            showlegend=False,
+        )
+    )
+
+
 def generate_legend_params(cur_sp, cur_cs, color_by, used_legendgroups):
     if color_by == "Carbon Source":
         legendgroup, name = cur_cs, cur_cs
@@ -139,7 +289,18 @@ def generate_legend_params(cur_sp, cur_cs, color_by, used_legendgroups):
     return showlegend, legendgroup, name, used_legendgroups
 
 
-def plot_data(df_merged, filtered_metadata, color_by, plot_replicates, plot_type, fig_layout):
+def plot_data(
+    measurement_index,
+    filtered_metadata,
+    color_by,
+    plot_replicates,
+    plot_spread,
+    plot_type,
+    fig_layout,
+    max_points=None,
+    x_range=None,
+):
+    # Traces longer than max_points are decimated, see plot_indices.
     (
         projects_present,
         species_selected,
@@ -160,6 +321,9 @@ def plot_data(df_merged, filtered_metadata, color_by, plot_replicates, plot_type
         "#17becf",
     ]
     max_colors = len(color_palette)
+    mean_curves = plot_replicates == None or len(plot_replicates) == 0
+    if mean_curves:
+        aggregated = aggregate_replicates(measurement_index, filtered_metadata)
 
     fig = go.Figure(layout=fig_layout)
     used_legendgrouos = []
@@ -176,46 +340,50 @@ def plot_data(df_merged, filtered_metadata, color_by, plot_replicates, plot_type
                 }
                 for k in range(len(concentrations_present[i_0][i][j])):
                     cur_conc = concentrations_present[i_0][i][j][k]
-                    cur_lgs = lg_replicates[i_0][i][j][k]
-                    cur_exp_ID = df_merged[df_merged["linegroup"] == cur_lgs[0]][
-                        "exp_ID"
-                    ].values[0]
-                    experimenter = df_merged[df_merged["linegroup"] == cur_lgs[0]][
-                        "Experimenter"
-                    ].values[0]
+                    # Linegroups without measurements are not plotted
+                    cur_lgs = [
+                        lg
+                        for lg in lg_replicates[i_0][i][j][k]
+                        if lg in measurement_index
+                    ]
+                    if len(cur_lgs) == 0:
+                        continue
+                    cur_exp_ID = measurement_index.first(cur_lgs[0], "exp_ID")
+                    experimenter = measurement_index.first(cur_lgs[0], "Experimenter")
                     hovertext = f"<b>Species:</b> {cur_sp}<br><b>Carbon Source:</b> {cur_cs}<br><b>CS Concentration</b>: {cur_conc}<br><b>Time</b>: %{{x}}<br><b>Measurement:</b> %{{y}}<br><b>Experimenter</b>: {experimenter}<br><b>Project</b>: {cur_project}<br><b>Experiment</b>: {cur_exp_ID}"
-                    if plot_replicates == None or len(plot_replicates) == 0:
+                    if mean_curves:
+                        group = aggregated.get((cur_project, cur_sp, cur_cs, cur_conc))
+                        if group is None:
+                            continue
                         showlegend, legendgroup, name, used_legendgrouos = (
                             generate_legend_params(
                                 cur_sp, cur_cs, color_by, used_legendgrouos
                             )
                         )
-                        common_time = np.array(
-                            [
-                                df_merged[df_merged["linegroup"] == cur_lgs[i]]["time"]
-                                for i in range(len(cur_lgs))
-                            ]
-                        )
-                        common_measurement = np.array(
-                            [
-                                df_merged[df_merged["linegroup"] == cur_lgs[i]][
-                                    "measurement"
-                                ]
-                                for i in range(len(cur_lgs))
-                            ]
-                        )
+                        if plot_spread and len(cur_lgs) > 1:
+                            add_band(
+                                fig,
+                                group["time"],
+                                group["mean"] - group["std"],
+                                group["mean"] + group["std"],
+                                color_dict,
+                                legendgroup,
+                                max_points,
+                                x_range,
+                            )
                         add_trace(
                             fig,
-                            common_time[0],
-                            np.mean(common_measurement, axis=0),
+                            group["time"],
+                            group["mean"],
                             color_dict,
                             legendgroup,
                             name,
                             hovertext,
                             showlegend,
+                            max_points,
+                            x_range,
                         )
 
-
                     else:
                         for l in range(len(cur_lgs)):
                             showlegend, legendgroup, name, used_legendgrouos = (
@@ -224,12 +392,10 @@ def plot_data(df_merged, filtered_metadata, color_by, plot_replicates, plot_type
                                 )
                             )
                             cur_lg = cur_lgs[l]
-                            cur_time = df_merged[df_merged["linegroup"] == cur_lg][
-                                "time"
-                            ]
-                            cur_measurement = df_merged[
-                                df_merged["linegroup"] == cur_lg
-                            ]["measurement"]
+                            cur_time = measurement_index.get(cur_lg, "time")
+                            cur_measurement = measurement_index.get(
+                                cur_lg, "measurement"
+                            )
                             add_trace(
                                 fig,
                                 cur_time,
@@ -239,32 +405,24 @@ def plot_data(df_merged, filtered_metadata, color_by, plot_replicates, plot_type
                                 name,
                                 hovertext,
                                 showlegend,
+                                max_points,
+                                x_range,
                             )
     if(plot_type == "log-scale"):
         fig.update_yaxes(type="log",range=[-3, 1])
 
     return fig
 
-def export_restructuring(df_measurements,filter_metadata):
-    df_export = pd.DataFrame()
+def export_restructuring(measurement_index, filter_metadata):
+    columns = {}
     lg_list = filter_metadata["linegroup"].unique()
     for lg in lg_list:
-        time_values = df_measurements[df_measurements["linegroup"] == lg][
-            "time"
-        ].to_numpy()
-        measurement_values = df_measurements[df_measurements["linegroup"] == lg][
-            "measurement"
-        ].to_numpy()
-        df_export = pd.concat(
-            [
-                df_export,
-                pd.DataFrame(
-                    {f"{lg}_time": time_values, f"{lg}_measurement": measurement_values}
-                ),
-            ],
-            axis=1,
+        columns[f"{lg}_time"] = pd.Series(measurement_index.get(lg, "time"))
+        columns[f"{lg}_measurement"] = pd.Series(
+            measurement_index.get(lg, "measurement")
         )
-    return df_export
+    return pd.DataFrame(columns)
+
 
 def show_table(filtered_metadata):
     to_show_in_table = [
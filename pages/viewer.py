@@ -1,144 +1,171 @@
 import dash
-from dash import dcc, html, callback, Output, Input, State, no_update
+from dash import (
+    dcc,
+    html,
+    callback,
+    clientside_callback,
+    ctx,
+    Output,
+    Input,
+    State,
+    no_update,
+)
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 import pandas as pd
 import zipfile
 from io import BytesIO
+from uuid import uuid4
 from . import utils
+from . import sessions
+from .measurements import MeasurementIndex
+from .metadata import metadata_service
 
-pooled_df_joint_metadata = pd.read_csv("metadata/pooled_df_joint_metadata.csv")
-projects, cs, species = utils.load_dropdown_data(pooled_df_joint_metadata)
-
-loaded_data = []
-loaded_metadata = []
 # Dash layout
 dash.register_page(__name__, path="/", name="Home", order=1)  # '/' is home page
 
-layout = html.Div(
-    [
-        dbc.Row(html.H2("Data viewer"), class_name="pb-2"),
-        dbc.Col(
-            [
-                dbc.Row(
-                    html.Span("Select projects and conditions:"),
-                    class_name="pb-1",
-                ),
-                dbc.Row(
-                    dcc.Dropdown(
-                        options=projects,
-                        placeholder="Select Project",
-                        id="proj-dropdown",
-                        multi=True,
-                    ),
-                    class_name="pb-1",
-                ),
-                dbc.Row(
-                    dcc.Dropdown(
-                        options=cs,
-                        placeholder="Select Carbon Source",
-                        id="cs-dropdown",
-                        multi=True,
+
+# The layout is built on every page load, so the dropdowns list projects which
+# were ingested while the server is running.
+def layout(**kwargs):
+    metadata_index = metadata_service.current()
+    return html.Div(
+        [
+            dbc.Row(html.H2("Data viewer"), class_name="pb-2"),
+            dbc.Col(
+                [
+                    dbc.Row(
+                        html.Span("Select projects and conditions:"),
+                        class_name="pb-1",
                     ),
-                    class_name="pb-1",
-                ),
-                dbc.Row(
-                    dcc.Dropdown(
-                        options=species,
-                        placeholder="Select Species",
-                        id="species-dropdown",
-                        multi=True,
+                    dbc.Row(
+                        dcc.Dropdown(
+                            options=metadata_index.projects,
+                            placeholder="Select Project",
+                            id="proj-dropdown",
+                            multi=True,
+                        ),
+                        class_name="pb-1",
                     ),
-                    class_name="pb-1",
-                ),
-            ],
-            width=6,
-        ),
-        dbc.Col(
-            [
-                dbc.Row(html.H6("Color graph by:"), class_name="pt-4"),
-                dbc.Row(
-                    dcc.Dropdown(
-                        options=["Carbon Source", "Species"],
-                        value="Carbon Source",
-                        id="color-by",
+                    dbc.Row(
+                        dcc.Dropdown(
+                            options=metadata_index.cs,
+                            placeholder="Select Carbon Source",
+                            id="cs-dropdown",
+                            multi=True,
+                        ),
+                        class_name="pb-1",
                     ),
-                    class_name="pt-1",
-                ),
-                dbc.Row(
-                    dbc.Checklist(options={"label":" Plot replicates"}, id="plot-replicates"),
-                    class_name="pt-1",
-                ),
-                dbc.Row(
-                    dbc.RadioItems(
-                        options=[
-                            {"label": "Linear y-axis", "value": "linear-scale"},
-                            {"label": "Log-scale y-axis", "value": "log-scale"},
-                        ],
-                        value="linear-scale",
-                        id="plot-type",
+                    dbc.Row(
+                        dcc.Dropdown(
+                            options=metadata_index.species,
+                            placeholder="Select Species",
+                            id="species-dropdown",
+                            multi=True,
+                        ),
+                        class_name="pb-1",
                     ),
-                    class_name="pt-1",
-                ),
-            ],
-            width=3,
-        ),
-        dbc.Col(
-            dcc.Graph(
-                figure={},
-                id="controls-and-graph",
+                ],
+                width=6,
             ),
-            width=11,
-            class_name="pb-3",
-        ),
-        dbc.Col(
-            html.Details(
+            dbc.Col(
                 [
-                    html.Summary(html.Span("Project description")),
-                    html.Span(
-                        children=[""],
-                        id="project-description",
+                    dbc.Row(html.H6("Color graph by:"), class_name="pt-4"),
+                    dbc.Row(
+                        dcc.Dropdown(
+                            options=["Carbon Source", "Species"],
+                            value="Carbon Source",
+                            id="color-by",
+                        ),
+                        class_name="pt-1",
+                    ),
+                    dbc.Row(
+                        dbc.Checklist(options={"label":" Plot replicates"}, id="plot-replicates"),
+                        class_name="pt-1",
+                    ),
+                    dbc.Row(
+                        dbc.Checklist(
+                            options={"spread": " Plot replicate spread (± SD)"},
+                            id="plot-spread",
+                        ),
+                        class_name="pt-1",
+                    ),
+                    dbc.Row(
+                        dbc.RadioItems(
+                            options=[
+                                {"label": "Linear y-axis", "value": "linear-scale"},
+                                {"label": "Log-scale y-axis", "value": "log-scale"},
+                            ],
+                            value="linear-scale",
+                            id="plot-type",
+                        ),
+                        class_name="pt-1",
                     ),
                 ],
+                width=3,
             ),
-            class_name="pb-1",
-            width=11,
-        ),
-        dbc.Col(
-            html.Details(
+            dbc.Col(
                 [
-                    html.Summary(html.Span("Experiment description")),
-                    html.Span(
-                        children=[""],
-                        id="experiment-description",
+                    dcc.Graph(
+                        figure={},
+                        id="controls-and-graph",
                     ),
+                    # Width of the graph in pixels, sets the points per trace
+                    dcc.Store(id="graph-width"),
                 ],
+                width=11,
+                class_name="pb-3",
             ),
-            class_name="pb-1",
-            width=11,
-        ),
-        dbc.Col(
-            html.Details(
+            dbc.Col(
+                html.Details(
+                    [
+                        html.Summary(html.Span("Project description")),
+                        html.Span(
+                            children=[""],
+                            id="project-description",
+                        ),
+                    ],
+                ),
+                class_name="pb-1",
+                width=11,
+            ),
+            dbc.Col(
+                html.Details(
+                    [
+                        html.Summary(html.Span("Experiment description")),
+                        html.Span(
+                            children=[""],
+                            id="experiment-description",
+                        ),
+                    ],
+                ),
+                class_name="pb-1",
+                width=11,
+            ),
+            dbc.Col(
+                html.Details(
+                    [
+                        html.Summary(html.Span("Metadata")),
+                        html.Span(
+                            children=[""],
+                            id="metadata-table",
+                        ),
+                    ],
+                ),
+                width=11,
+            ),
+            dbc.Col(
                 [
-                    html.Summary(html.Span("Metadata")),
-                    html.Span(
-                        children=[""],
-                        id="metadata-table",
-                    ),
+                    dbc.Button("Download Data", id="download-btn"),
+                    dcc.Download(id="download-data"),
+                    # Key of the selection of this page load, see sessions.py
+                    dcc.Store(id="viewer-session", data=str(uuid4())),
                 ],
+                class_name="pt-3 pb-4",
+                width="auto",
             ),
-            width=11,
-        ),
-        dbc.Col(
-            [
-                dbc.Button("Download Data", id="download-btn"),
-                dcc.Download(id="download-data"),
-            ],
-            class_name="pt-3 pb-4",
-            width="auto",
-        ),
-    ]
-)
+        ]
+    )
 
 
 # Callback for plotting the selected data
@@ -155,16 +182,53 @@ layout = html.Div(
         Input("species-dropdown", "value"),
         Input("color-by", "value"),
         Input("plot-replicates", "value"),
+        Input("plot-spread", "value"),
         Input("plot-type", "value"),
+        Input("controls-and-graph", "relayoutData"),
+        Input("graph-width", "data"),
     ],
+    State("viewer-session", "data"),
 )
 def update_graph_view(
-    proj_chosen, chosen_carbon_sources, chosen_species, color_by, plot_replicates,plot_type
+    proj_chosen,
+    chosen_carbon_sources,
+    chosen_species,
+    color_by,
+    plot_replicates,
+    plot_spread,
+    plot_type,
+    relayout_data,
+    graph_width,
+    session_id,
 ):
+    # Zooming redraws the traces with more points in the visible range and
+    # resizing with the points of the new width, the tables are left as they
+    # are.
+    redraw = ctx.triggered_id in ["controls-and-graph", "graph-width"]
+    x_range = None
+    if redraw:
+        x_range = utils.relayout_x_range(relayout_data)
+        if x_range is False:
+            if ctx.triggered_id == "controls-and-graph":
+                return no_update, no_update, no_update, no_update
+            # The last relayout, e.g. an autosize, did not change the x-axis
+            x_range = None
     fig_layout = go.Layout(
         margin=dict(l=0, r=50, t=50, b=10),
         xaxis=dict(title="Time [h]"),
         yaxis=dict(title="OD"),
+        # The zoom is kept while the traces are redrawn for the same selection
+        uirevision=str(
+            [
+                proj_chosen,
+                chosen_carbon_sources,
+                chosen_species,
+                color_by,
+                plot_replicates,
+                plot_spread,
+                plot_type,
+            ]
+        ),
     )
     parsed_data_dir = "export"
     if (
@@ -175,26 +239,44 @@ def update_graph_view(
         or chosen_species == "Select Species"
         or chosen_species == None
     ):
+        # Nothing is selected, the download must not serve the last selection
+        sessions.save_selection(session_id, [])
         fig = go.Figure(layout=fig_layout)
         return fig, [], "", ""
-    args = projects[1:], species, cs, pooled_df_joint_metadata, parsed_data_dir
+    metadata_index = metadata_service.current()
+    args = (
+        metadata_index.projects[1:],
+        metadata_index.species,
+        metadata_index.cs,
+        metadata_index,
+        parsed_data_dir,
+    )
     filtered_metadata = utils.load_selected_metadata(
         proj_chosen, chosen_carbon_sources, chosen_species, args
     )
     if len(filtered_metadata) == 0:
+        sessions.save_selection(session_id, [])
         fig = go.Figure(layout=fig_layout)
         return fig, [], "", ""
 
     df_merged = utils.load_data_from_metadata(filtered_metadata, args)
-
-    global loaded_data
-    loaded_data = df_merged.copy()
-    global loaded_metadata
-    loaded_metadata = filtered_metadata.copy()
+    measurement_index = MeasurementIndex(df_merged)
 
     fig = utils.plot_data(
-        df_merged, filtered_metadata, color_by, plot_replicates, plot_type,fig_layout
+        measurement_index,
+        filtered_metadata,
+        color_by,
+        plot_replicates,
+        plot_spread,
+        plot_type,
+        fig_layout,
+        utils.point_budget(graph_width),
+        x_range,
     )
+    if redraw:
+        return fig, no_update, no_update, no_update
+    # Only the linegroups are kept for the download, not the data
+    sessions.save_selection(session_id, filtered_metadata["linegroup"])
     table_df = utils.show_table(filtered_metadata)
 
     return (
@@ -205,6 +287,41 @@ def update_graph_view(
     )
 
 
+# Width of the graph in pixels, which sets the points per trace. It is reported
+# again once the window was resized and resizing paused for half a second.
+clientside_callback(
+    """
+    function(id) {
+        const width = function() {
+            const graph = document.getElementById(id);
+            return graph ? graph.offsetWidth : window.innerWidth;
+        };
+        if (!window.graphWidthListener) {
+            let timer;
+            window.graphWidthListener = function() {
+                clearTimeout(timer);
+                timer = setTimeout(function() {
+                    // The viewer may have been left in the meantime
+                    if (!document.getElementById(id) || width() === window.graphWidth) {
+                        return;
+                    }
+                    window.graphWidth = width();
+                    window.dash_clientside.set_props(
+                        "graph-width", {data: window.graphWidth}
+                    );
+                }, 500);
+            };
+            window.addEventListener("resize", window.graphWidthListener);
+        }
+        window.graphWidth = width();
+        return window.graphWidth;
+    }
+    """,
+    Output("graph-width", "data"),
+    Input("controls-and-graph", "id"),
+)
+
+
 # Callback for updating the dropdowns in the View Data tab
 @callback(
     [Output(component_id="cs-dropdown", component_property="options")],
@@ -214,32 +331,49 @@ def update_graph_view(
     ],
 )
 def update_dropwdown(chosen_project):
-    df = pooled_df_joint_metadata
-    if chosen_project is None:
-        return sorted(list(set(df["carbon_source"]))), sorted(list(set(df["species"])))
-    if len(chosen_project) == 0:
-        return sorted(list(set(df["carbon_source"]))), sorted(list(set(df["species"])))
+    metadata_index = metadata_service.current()
+    if chosen_project is None or len(chosen_project) == 0:
+        return metadata_index.values("carbon_source"), metadata_index.values("species")
     elif "All" in chosen_project:
-        return ["All"] + sorted(list(set(df["carbon_source"]))), ["All"] + sorted(list(set(df["species"])))
+        carbon_sources = metadata_index.values("carbon_source")
+        species_present = metadata_index.values("species")
     else:
-        df = df[df["project"].isin(chosen_project)]
-        return ["All"] +sorted( list(set(df["carbon_source"]))),["All"] +  sorted(list(set(df["species"])))
+        carbon_sources = metadata_index.values("carbon_source", chosen_project)
+        species_present = metadata_index.values("species", chosen_project)
+    return ["All"] + carbon_sources, ["All"] + species_present
 
 
 # Callback for downloading the data
 @callback(
     Output("download-data", "data"),
     Input("download-btn", "n_clicks"),
+    State("viewer-session", "data"),
     prevent_initial_call=True,
 )
-def download_data(n_clicks):
+def download_data(n_clicks, session_id):
     if n_clicks is None:
         return dash.no_update
+    linegroups = sessions.load_selection(session_id)
+    if linegroups is None:
+        return dash.no_update
 
-    df_measurements = loaded_data.copy()
-    filter_metadata = loaded_metadata.copy()
+    # The selection is loaded again, usually from the measurement cache
+    metadata_index = metadata_service.current()
+    args = (
+        metadata_index.projects[1:],
+        metadata_index.species,
+        metadata_index.cs,
+        metadata_index,
+        "export",
+    )
+    filter_metadata = metadata_index.select_linegroups(linegroups)
+    if len(filter_metadata) == 0:
+        return dash.no_update
+    measurement_index = MeasurementIndex(
+        utils.load_data_from_metadata(filter_metadata, args)
+    )
 
-    df_export = utils.export_restructuring(df_measurements, filter_metadata)
+    df_export = utils.export_restructuring(measurement_index, filter_metadata)
 
     zip_buffer = BytesIO()
     with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
@@ -0,0 +1,48 @@
+from os import environ, getpid
+from threading import Thread
+from time import sleep
+from logging import getLogger
+from .metadata import metadata_service
+from .measurements import measurement_cache
+
+# Picks up ingests by parse_data.py while the dashboard is running. A thread
+# polls the pooled metadata in metadata/ and the exports in export/ of the
+# cached projects, reloads the metadata once it changed and drops only the
+# cached measurements of projects whose export changed.
+
+# Seconds between two polls, set with CURVES_WATCH_INTERVAL, 0 disables it.
+WATCH_INTERVAL = float(environ.get("CURVES_WATCH_INTERVAL", 5))
+
+logger = getLogger(__name__)
+
+
+class ExportWatcher:
+    def __init__(self, interval):
+        self.interval = interval
+        self.pid = None
+
+    def poll(self):
+        metadata_service.current()
+        for project in measurement_cache.invalidate_changed():
+            logger.info("Export of " + project + " changed")
+
+    def run(self):
+        while True:
+            sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as error:
+                logger.warning("Polling the exports failed, " + repr(error))
+
+    def start(self):
+        # Starts polling in this process. Threads do not survive a fork, so
+        # every gunicorn worker starts its own watcher.
+        if self.interval <= 0 or self.pid == getpid():
+            return
+        self.pid = getpid()
+        Thread(target=self.run, daemon=True).start()
+        # Cached measurements are only checked by the watcher from now on
+        measurement_cache.watched_pid = self.pid
+
+
+export_watcher = ExportWatcher(WATCH_INTERVAL)
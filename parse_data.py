@@ -1,15 +1,22 @@
 import pandas as pd
 from os.path import join, exists
-from os import walk, makedirs
+from os import walk, makedirs, stat, replace
 from datetime import time, timedelta
 import numpy as np
 import sys
 from logging import getLogger, DEBUG, INFO, StreamHandler, FileHandler, Formatter
 from argparse import ArgumentParser
 from functools import reduce
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from hashlib import sha256
+import json
+from pages.measurements import write_measurements, MeasurementIndex
+from pages.fit_cache import project_store
 
 
-def create_log(name, log_file):
+def create_log(name, log_file, mode="w"):
     # Create a logger which is initialized for every experiment
     logger = getLogger(name)
     if logger.hasHandlers():
@@ -17,7 +24,7 @@ def create_log(name, log_file):
     logger.setLevel(DEBUG)  # Set the base logger level
 
     # Create a file handler for logging to a file
-    file_handler = FileHandler(log_file, mode="w")
+    file_handler = FileHandler(log_file, mode=mode)
     file_handler.setLevel(DEBUG)  # Set the file handler level
 
     # Create a console handler for logging to the console
@@ -35,12 +42,49 @@ def create_log(name, log_file):
     return logger
 
 
-def parse_technical_data(data_dir, project, plate_name, logger):
+# Exported tables in the order they are returned by parse_plate, the
+# measurements are stored separately by write_measurements.
+EXPORT_TABLES = [
+    "technical_data",
+    "run_data",
+    "carbon_source_data",
+    "species_data",
+    "inhibitor_data",
+    "comment_data",
+]
+# Source files of a plate which are tracked in the ingest manifest.
+SOURCE_FILES = ["data.xlsx", "combined_metadata.xlsx"]
+MANIFEST = "ingest_manifest.json"
+
+# Sheets of combined_metadata.xlsx with the options they are read with.
+# Sheets in the format of the 96 well plate keep empty cells as "".
+METADATA_SHEETS = {
+    "Metadata": {},
+    "Groups": {"index_col": 0},
+    "Species": {"index_col": 0, "keep_default_na": False},
+    "Carbon Source": {"index_col": 0, "keep_default_na": False},
+    "CS Concentration": {"index_col": 0, "keep_default_na": False},
+    "Base Media": {"index_col": 0, "keep_default_na": False},
+    "Inhibitor": {"index_col": 0, "keep_default_na": False},
+    "Inhibitor Conc": {"index_col": 0, "keep_default_na": False},
+    "Comments": {"index_col": 0, "keep_default_na": False},
+}
+
+
+def load_workbook(data_dir, project, plate_name):
+    # Reads all sheets of the metadata workbook, the file is opened only once.
+    with pd.ExcelFile(
+        join(data_dir, project, plate_name, "combined_metadata.xlsx")
+    ) as workbook:
+        return {
+            sheet_name: workbook.parse(sheet_name, **options)
+            for sheet_name, options in METADATA_SHEETS.items()
+        }
+
+
+def parse_technical_data(sheets, project, plate_name, logger):
     # Parses details about the experiment from the Metadata sheet
-    df = pd.read_excel(
-        join(data_dir, project, plate_name, "combined_metadata.xlsx"),
-        sheet_name="Metadata",
-    )
+    df = sheets["Metadata"]
     exp_ID = project + "_" + plate_name
     experimenter = df["Experimenter's Name"]
     experiment_description = df["Experiment description"]
@@ -75,18 +119,14 @@ def parse_technical_data(data_dir, project, plate_name, logger):
     return technical_data
 
 
-def parse_sheet(meta, data_dir, project, plate_name, sheet_name, key_name, logger):
+def parse_sheet(meta, sheets, sheet_name, key_name, logger):
     # Parsed the information that have the format of the 96 well plate.
     # All fields are mandatory.
-    df = pd.read_excel(
-        join(data_dir, project, plate_name, "combined_metadata.xlsx"),
-        sheet_name=sheet_name,
-        index_col=0,
-        keep_default_na=False,
-    )
+    df = sheets[sheet_name]
     for sample_name, sample in meta.items():
         well = sample["samples"][0]
-        i, c = well[0], int(well[1:])
+        i = well.rstrip("0123456789")
+        c = int(well[len(i) :])
         value = df.at[i, c]
         meta[sample_name][key_name] = value
         if value == "":
@@ -98,13 +138,9 @@ def parse_sheet(meta, data_dir, project, plate_name, sheet_name, key_name, logge
     return meta
 
 
-def parse_meta_data(data_dir, project, plate_name, logger):
+def parse_meta_data(sheets, project, plate_name, logger):
     # Parses the sample names and the corresponding blanks from the Groups sheet.
-    df = pd.read_excel(
-        join(data_dir, project, plate_name, "combined_metadata.xlsx"),
-        sheet_name="Groups",
-        index_col=0,
-    )
+    df = sheets["Groups"]
     sample_names = []
     blanks = 0
     for entry in df.to_numpy().flatten():
@@ -130,29 +166,25 @@ def parse_meta_data(data_dir, project, plate_name, logger):
         }
         for key in set(sample_names)
     }
-    # Storing well names of corresponding samples
+    # Wells of every entry of the Groups sheet, so samples and blanks are
+    # looked up instead of scanning the plate for every sample.
+    wells_by_entry = {}
     for c in df.columns:
         for i in df.index:
-            well = i + str(c)
             entry = df.at[i, c]
             if isinstance(entry, str):
-                if entry[0] == "S":
-                    meta[df.at[i, c]]["samples"].append(well)
-                    meta[df.at[i, c]]["linegroup"].append(
-                        "_".join([project, plate_name, well])
-                    )
+                wells_by_entry.setdefault(entry, []).append(i + str(c))
                 if entry[0] == "B":
                     blanks += 1
 
-    # Stroring corresponding blank wells
+    # Storing well names of corresponding samples and their blank wells
     for sample in meta.keys():
+        meta[sample]["samples"] = wells_by_entry[sample]
+        meta[sample]["linegroup"] = [
+            "_".join([project, plate_name, well]) for well in wells_by_entry[sample]
+        ]
         blank = sample[sample.find("B") :]
-        for c in df.columns:
-            for i in df.index:
-                well = i + str(c)
-                entry = df.at[i, c]
-                if entry == blank:
-                    meta[sample]["blanks"].append(well)
+        meta[sample]["blanks"] = wells_by_entry.get(blank, [])
 
     if len(sample_names) > 0:
         logger.info(
@@ -169,31 +201,53 @@ def parse_meta_data(data_dir, project, plate_name, logger):
     if blanks == 0:
         logger.warning("No blanks found in the Groups sheet.")
 
-    meta = parse_sheet(
-        meta, data_dir, project, plate_name, "Species", "species", logger
-    )
-    meta = parse_sheet(
-        meta, data_dir, project, plate_name, "Carbon Source", "carbon_source", logger
-    )
-    meta = parse_sheet(
-        meta, data_dir, project, plate_name, "CS Concentration", "cs_conc", logger
-    )
-    meta = parse_sheet(
-        meta, data_dir, project, plate_name, "Base Media", "base_media", logger
-    )
-    meta = parse_sheet(
-        meta, data_dir, project, plate_name, "Inhibitor", "inhibitor", logger
-    )
-    meta = parse_sheet(
-        meta, data_dir, project, plate_name, "Inhibitor Conc", "inhibitor_conc", logger
-    )
-    meta = parse_sheet(
-        meta, data_dir, project, plate_name, "Comments", "comments", logger
-    )
+    meta = parse_sheet(meta, sheets, "Species", "species", logger)
+    meta = parse_sheet(meta, sheets, "Carbon Source", "carbon_source", logger)
+    meta = parse_sheet(meta, sheets, "CS Concentration", "cs_conc", logger)
+    meta = parse_sheet(meta, sheets, "Base Media", "base_media", logger)
+    meta = parse_sheet(meta, sheets, "Inhibitor", "inhibitor", logger)
+    meta = parse_sheet(meta, sheets, "Inhibitor Conc", "inhibitor_conc", logger)
+    meta = parse_sheet(meta, sheets, "Comments", "comments", logger)
 
     return meta
 
 
+def convert_time(time_column, logger):
+    # Converts the time stamps to seconds. Excel has a weird time formatting
+    # where format changes after 24 hours, so the format is detected for every
+    # contiguous block of cells and each block is converted at once.
+    # Bioreader outputs as fraction of days
+    if pd.api.types.is_float_dtype(time_column):
+        return time_column.to_numpy() * 86400
+    if pd.api.types.is_timedelta64_dtype(time_column):
+        return time_column.dt.total_seconds().to_numpy()
+    values = pd.Series(time_column.to_numpy(dtype=object), dtype=object)
+    kinds = values.map(type)
+    blocks = (kinds != kinds.shift()).cumsum()
+    seconds = np.full(len(values), np.nan)
+    for _, block in values.groupby(blocks):
+        kind = type(block.iloc[0])
+        # In case format is HH:MM:SS as time, fractions of seconds are dropped
+        if issubclass(kind, time):
+            block_seconds = np.floor(
+                pd.to_timedelta(block.astype(str)).dt.total_seconds()
+            )
+        # In case format is D:H:MM:SS
+        elif issubclass(kind, timedelta):
+            block_seconds = pd.to_timedelta(block).dt.total_seconds()
+        # In case format is HH:MM:SS as string
+        elif issubclass(kind, str):
+            block_seconds = pd.to_timedelta(block).dt.total_seconds()
+        # Bioreader outputs as fraction of days, this could cause issues in the future
+        elif issubclass(kind, float):
+            block_seconds = block.astype(float) * 86400
+        else:
+            logger.error("Format of time stamps is not recognized")
+            sys.exit()
+        seconds[block.index] = block_seconds
+    return seconds
+
+
 def parse_raw_data(dir, logger):
     # Parsed time series data, with columns Time, followed by well names.
     df = pd.read_excel(join(dir, "data.xlsx"))
@@ -205,26 +259,7 @@ def parse_raw_data(dir, logger):
                 "Data must be a time series where the first columns is called Time, followed by the well names as further columns"
             )
             sys.exit()
-    ts = []
-    for i in df["Time"]:
-        # Excel has a weird time formatting where format changes after 24 hours.
-        # In case format is HH:MM:SS as time
-        if type(i) is time:
-            ts.append(i.hour * 60 * 60 + i.minute * 60 + i.second)
-        # In case format is D:H:MM:SS
-        elif type(i) is timedelta:
-            ts.append(i.total_seconds())
-        # In case format is HH:MM:SS as string
-        elif type(i) is str:
-            hour, minute, second = i.split(":")
-            ts.append(int(hour) * 60 * 60 + int(minute) * 60 + int(second))
-        # Bioreader outputs as fraction of days, this could cause issues in the future
-        elif type(i) is float:
-            ts.append(i * 86400)
-        else:
-            logger.error("Format of time stamps is not recognized")
-            sys.exit()
-    df["Time"] = np.array(ts) / 60 / 60
+    df["Time"] = convert_time(df["Time"], logger) / 60 / 60
     non_nan_time_loc = df["Time"].notna()
     df = df[non_nan_time_loc]
     return df
@@ -232,94 +267,81 @@ def parse_raw_data(dir, logger):
 
 def parse_meta_to_df(meta, raw, project, plate_name):
     # Converts metadate stored in dictionary into tables.
-    df_run = pd.DataFrame()
-    df_carbon_source = pd.DataFrame()
-    df_species = pd.DataFrame()
-    df_inhibitor = pd.DataFrame()
-    df_measurement = pd.DataFrame()
-    df_comments = pd.DataFrame()
-    df_measurement = pd.DataFrame()
-
-    measurement_dfs = []
+    # Columns are collected as lists and every table is constructed once.
+    exp_ID = project + "_" + plate_name
+    keys = [
+        "species",
+        "carbon_source",
+        "cs_conc",
+        "base_media",
+        "inhibitor",
+        "inhibitor_conc",
+        "comments",
+    ]
+    linegroups = []
+    columns = {key: [] for key in keys}
+    wells = []
+    # Index of the blank group of every well, samples sharing the same blank
+    # wells share a group.
+    blank_groups = {}
+    well_groups = []
 
     for sample_name, sample in meta.items():
-        if len(sample["blanks"]) == 0:
-            blank = 0
-        else:
-            blank = raw[sample["blanks"]].mean(axis=1)
-        for wellID in range(len(sample["samples"])):
-            well = sample["samples"][wellID]
-            linegroup = sample["linegroup"][wellID]
-            df_run = pd.concat(
-                [
-                    df_run,
-                    pd.DataFrame(
-                        {
-                            "project": project,
-                            "exp_ID": project + "_" + plate_name,
-                            "linegroup": linegroup,
-                        },
-                        index=[0],
-                    ),
-                ]
-            )
-            df_carbon_source = pd.concat(
-                [
-                    df_carbon_source,
-                    pd.DataFrame(
-                        {
-                            "linegroup": linegroup,
-                            "carbon_source": sample["carbon_source"],
-                            "cs_conc": sample["cs_conc"],
-                            "base_media": sample["base_media"],
-                        },
-                        index=[0],
-                    ),
-                ]
-            )
-            df_species = pd.concat(
-                [
-                    df_species,
-                    pd.DataFrame(
-                        {"linegroup": linegroup, "species": sample["species"]},
-                        index=[0],
-                    ),
-                ]
-            )
-            df_inhibitor = pd.concat(
-                [
-                    df_inhibitor,
-                    pd.DataFrame(
-                        {
-                            "linegroup": linegroup,
-                            "inhibitor": sample["inhibitor"],
-                            "inhibitor_conc": sample["inhibitor_conc"],
-                        },
-                        index=[0],
-                    ),
-                ]
-            )
-            df_comments = pd.concat(
-                [
-                    df_comments,
-                    pd.DataFrame(
-                        {"linegroup": linegroup, "comments": sample["comments"]},
-                        index=[0],
-                    ),
-                ]
-            )
-
-            measurement = raw[well] - blank
-            cur_measurement_df = pd.DataFrame(
-                {
-                    "linegroup": linegroup,
-                    "time": raw["Time"],
-                    "measurement": measurement,
-                }
-            )
-            measurement_dfs.append(cur_measurement_df)
+        group = blank_groups.setdefault(tuple(sample["blanks"]), len(blank_groups))
+        for well, linegroup in zip(sample["samples"], sample["linegroup"]):
+            wells.append(well)
+            well_groups.append(group)
+            linegroups.append(linegroup)
+            for key in keys:
+                columns[key].append(sample[key])
+
+    # Plate as (timepoint x well) matrix, blanks are averaged once per group
+    # and subtracted from all wells at once.
+    n_timepoints = len(raw)
+    # Samples without blanks keep a column of zeros.
+    blank_means = np.zeros((n_timepoints, len(blank_groups)))
+    for blank_wells, group in blank_groups.items():
+        if len(blank_wells) > 0:
+            blank_means[:, group] = raw[list(blank_wells)].mean(axis=1).to_numpy()
+    values = raw[wells].to_numpy(dtype=float) - blank_means[:, well_groups]
+
+    # Long format with all timepoints of a well in a row
+    df_measurement = pd.DataFrame(
+        {
+            "exp_ID": exp_ID,
+            "linegroup": np.repeat(linegroups, n_timepoints),
+            "time": np.tile(raw["Time"].to_numpy(), len(wells)),
+            "measurement": values.T.ravel(),
+        },
+        index=np.tile(raw.index, len(wells)),
+    )
 
-    df_measurement = pd.concat(measurement_dfs)
+    df_run = pd.DataFrame(
+        {
+            "project": [project] * len(linegroups),
+            "exp_ID": [exp_ID] * len(linegroups),
+            "linegroup": linegroups,
+        }
+    )
+    df_carbon_source = pd.DataFrame(
+        {
+            "linegroup": linegroups,
+            "carbon_source": columns["carbon_source"],
+            "cs_conc": columns["cs_conc"],
+            "base_media": columns["base_media"],
+        }
+    )
+    df_species = pd.DataFrame({"linegroup": linegroups, "species": columns["species"]})
+    df_inhibitor = pd.DataFrame(
+        {
+            "linegroup": linegroups,
+            "inhibitor": columns["inhibitor"],
+            "inhibitor_conc": columns["inhibitor_conc"],
+        }
+    )
+    df_comments = pd.DataFrame(
+        {"linegroup": linegroups, "comments": columns["comments"]}
+    )
     return (
         df_run,
         df_carbon_source,
@@ -330,51 +352,59 @@ def parse_meta_to_df(meta, raw, project, plate_name):
     )
 
 
-def pool_metadata(export_dfs, logger):
+def pool_metadata(export_dfs, logger, updated_exp_IDs):
+    # Upserts the metadata of the project into the pooled metadata. Rows of
+    # updated (changed or removed) plates are replaced, plates missing from the
+    # pooled metadata are added. Values are read as strings so the rows of other
+    # plates are written back as they were.
     try:
-        pooled_df_joint_metadata = pd.read_csv("metadata/pooled_df_joint_metadata.csv")
-        file_present = True
+        pooled_df_joint_metadata = pd.read_csv(
+            "metadata/pooled_df_joint_metadata.csv", dtype=str, keep_default_na=False
+        )
+        existing_exp_IDs = pooled_df_joint_metadata["exp_ID"].unique()
     except FileNotFoundError:
         pooled_df_joint_metadata = pd.DataFrame()
-        file_present = False
+        existing_exp_IDs = []
     df_technical, df_species, df_carbon_source, df_comments, df_run, df_inhibitor = (
         export_dfs
     )
+
+    new_exp_IDs = df_technical["exp_ID"].unique()
+    to_add_exp_IDs = set(new_exp_IDs) - set(existing_exp_IDs)
+    to_add_exp_IDs = to_add_exp_IDs | (set(updated_exp_IDs) & set(new_exp_IDs))
+    to_remove_exp_IDs = set(updated_exp_IDs) & set(existing_exp_IDs)
+
+    if len(to_add_exp_IDs) == 0 and len(to_remove_exp_IDs) == 0:
+        logger.info("No new metadata to add")
+        return False
+
     df_joint_technical = df_run.merge(df_technical, on="exp_ID", how="outer")
     df_joint_metadata = reduce(
         lambda x, y: pd.merge(x, y, on="linegroup", how="outer"),
         [df_joint_technical, df_species, df_carbon_source, df_inhibitor, df_comments],
     )
-
-    new_exp_IDs = df_technical["exp_ID"].unique()
-    if not file_present:
-        pooled_df_joint_metadata = pd.concat(
-            [pooled_df_joint_metadata, df_joint_metadata]
-        )
-        pooled_df_joint_metadata.to_csv(
-            "metadata/pooled_df_joint_metadata.csv", index=False
-        )
-        logger.info("Updated metadata successfully")
-        return True
-
-    existing_exp_IDs = pooled_df_joint_metadata["exp_ID"].unique()
-    to_add_exp_IDs = list(set(new_exp_IDs) - set(existing_exp_IDs))
-
-    if len(to_add_exp_IDs) > 0:
-        df_joint_metadata = df_joint_metadata[
-            df_joint_metadata["exp_ID"].isin(to_add_exp_IDs)
+    df_joint_metadata = df_joint_metadata[
+        df_joint_metadata["exp_ID"].isin(to_add_exp_IDs)
+    ]
+    if len(to_remove_exp_IDs) > 0:
+        pooled_df_joint_metadata = pooled_df_joint_metadata[
+            ~pooled_df_joint_metadata["exp_ID"].isin(to_remove_exp_IDs)
         ]
+    if len(df_joint_metadata) > 0:
         pooled_df_joint_metadata = pd.concat(
             [pooled_df_joint_metadata, df_joint_metadata]
         )
-        pooled_df_joint_metadata.to_csv(
-            "metadata/pooled_df_joint_metadata.csv", index=False
-        )
-        logger.info("Updated metadata successfully")
-        return True
-
-    logger.info("No new metadata to add")
-    return False
+    # Written to a temporary file which replaces the pooled metadata at once,
+    # the running dashboard reloads it and must not read a partial file.
+    pooled_df_joint_metadata.to_csv(
+        "metadata/pooled_df_joint_metadata.csv.tmp", index=False
+    )
+    replace(
+        "metadata/pooled_df_joint_metadata.csv.tmp",
+        "metadata/pooled_df_joint_metadata.csv",
+    )
+    logger.info("Updated metadata successfully")
+    return True
 
 
 def parse_project_description(data_dir, project):
@@ -387,8 +417,83 @@ def parse_project_description(data_dir, project):
     return text
 
 
-def main(data_dir, project):
-    # Main function to parse the data of the different experiments of the same project. Stores parsed tables in export directory.
+def file_hash(path):
+    file_sha = sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            file_sha.update(chunk)
+    return file_sha.hexdigest()
+
+
+def plate_fingerprint(plate_dir, previous):
+    # Size, mtime and content hash of the source files of a plate. Hashes are
+    # only recomputed for files whose size or mtime changed.
+    fingerprint = {}
+    for file_name in SOURCE_FILES:
+        file_stat = stat(join(plate_dir, file_name))
+        entry = {"size": file_stat.st_size, "mtime": file_stat.st_mtime_ns}
+        known = previous.get(file_name, {})
+        if known.get("size") == entry["size"] and known.get("mtime") == entry["mtime"]:
+            entry["sha256"] = known["sha256"]
+        else:
+            entry["sha256"] = file_hash(join(plate_dir, file_name))
+        fingerprint[file_name] = entry
+    return fingerprint
+
+
+def plate_changed(fingerprint, previous):
+    return any(
+        fingerprint[file_name]["sha256"] != previous.get(file_name, {}).get("sha256")
+        for file_name in SOURCE_FILES
+    )
+
+
+def load_manifest(save_folder):
+    # Fingerprints of the plates of the last ingest.
+    f = join(save_folder, MANIFEST)
+    if exists(f):
+        with open(f, "r") as handle:
+            return json.load(handle)
+    return {}
+
+
+def load_exported_tables(save_folder, stale_exp_IDs):
+    # Reads the previously exported tables without the rows of stale plates.
+    # Values are read as strings so unchanged rows are written back as they were.
+    tables = [
+        pd.read_csv(join(save_folder, name + ".csv"), dtype=str, keep_default_na=False)
+        for name in EXPORT_TABLES
+    ]
+    technical_data, run_data = tables[0], tables[1]
+    stale_linegroups = run_data[run_data["exp_ID"].isin(stale_exp_IDs)]["linegroup"]
+    tables[0] = technical_data[~technical_data["exp_ID"].isin(stale_exp_IDs)]
+    for i in range(1, len(tables)):
+        tables[i] = tables[i][~tables[i]["linegroup"].isin(stale_linegroups)]
+    return tables
+
+
+def parse_plate(data_dir, project, plate_name):
+    # Parses all tables of one plate. Runs in a worker process if plates are
+    # parsed in parallel.
+    log_file = join("export", project, "logs", plate_name + ".log")
+    logger = create_log(plate_name, log_file)
+    # Reads all sheets of the metadata workbook
+    sheets = load_workbook(data_dir, project, plate_name)
+    # Parses meta data for the samples
+    meta = parse_meta_data(sheets, project, plate_name, logger)
+    # Parsed meta data for the experiment.
+    technical = parse_technical_data(sheets, project, plate_name, logger)
+    # Parses measurement data
+    raw = parse_raw_data(join(data_dir, project, plate_name), logger)
+    # Creates tables for the meta data for the samples
+    return (technical,) + parse_meta_to_df(meta, raw, project, plate_name)
+
+
+def ingest_project(data_dir, project, jobs=1, force=False):
+    # Parses the data of the different experiments of the same project. Stores parsed tables in export directory.
+    # Only plates which are new or changed since the last ingest are parsed.
+    # Returns the exported tables for pooling the metadata.
+    start = perf_counter()
     # Creating necessary folders
     save_folder = join("export", project)
     makedirs(save_folder, exist_ok=True)
@@ -397,48 +502,95 @@ def main(data_dir, project):
     # Finds different experiements in the same projects
     dir = join(data_dir, project)
     plate_names = next(walk(dir))[1]
-    # Creates dataframes for combined experiments
-    technical_data = pd.DataFrame()
-    run_data = pd.DataFrame()
-    carbon_source_data = pd.DataFrame()
-    species_data = pd.DataFrame()
-    inhibitor_data = pd.DataFrame()
-    measurement_data = pd.DataFrame()
-    comment_data = pd.DataFrame()
-    # Iterates over different experiments
-    for plate_name in plate_names:
-        log_file = join("export", project, "logs", plate_name + ".log")
-        logger = create_log(plate_name, log_file)
-        # Parses meta data for the samples
-        meta = parse_meta_data(data_dir, project, plate_name, logger)
-        # Parsed meta data for the experiment.
-        technical_data = pd.concat(
-            [
-                technical_data,
-                parse_technical_data(data_dir, project, plate_name, logger),
-            ]
+    # Compares the source files with the manifest of the last ingest
+    manifest = load_manifest(save_folder)
+    exported = all(exists(join(save_folder, name + ".csv")) for name in EXPORT_TABLES)
+    if force or not exported:
+        manifest = {}
+    fingerprints = {
+        plate_name: plate_fingerprint(
+            join(dir, plate_name), manifest.get(plate_name, {})
         )
-        # Parses measurement data
-        raw = parse_raw_data(join(data_dir, project, plate_name), logger)
-        # Creates tables for the meta data for the samples
-        run, carbon_source, species, inhibitor, comment, measurement = parse_meta_to_df(
-            meta, raw, project, plate_name
+        for plate_name in plate_names
+    }
+    changed_plates = [
+        plate_name
+        for plate_name in plate_names
+        if plate_changed(fingerprints[plate_name], manifest.get(plate_name, {}))
+    ]
+    removed_plates = [
+        plate_name for plate_name in manifest.keys() if plate_name not in plate_names
+    ]
+    stale_exp_IDs = [
+        project + "_" + plate_name for plate_name in changed_plates + removed_plates
+    ]
+    # Parses the changed experiments, in parallel if jobs > 1
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            plates = list(
+                executor.map(
+                    parse_plate, repeat(data_dir), repeat(project), changed_plates
+                )
+            )
+    else:
+        plates = [
+            parse_plate(data_dir, project, plate_name) for plate_name in changed_plates
+        ]
+    # Creates dataframes for combined experiments, the rows of unchanged
+    # plates are taken from the previous export.
+    if len(manifest) > 0:
+        tables = [[table] for table in load_exported_tables(save_folder, stale_exp_IDs)]
+    else:
+        tables = [[] for name in EXPORT_TABLES]
+    for plate in plates:
+        for table, plate_table in zip(tables, plate):
+            table.append(plate_table)
+    (
+        technical_data,
+        run_data,
+        carbon_source_data,
+        species_data,
+        inhibitor_data,
+        comment_data,
+    ) = [pd.concat(table) for table in tables]
+    measurement_dfs = [plate[-1] for plate in plates]
+    # Pooling is logged to the log of the last plate
+    logger = create_log(
+        plate_names[-1], join(log_dir, plate_names[-1] + ".log"), mode="a"
+    )
+
+    if len(stale_exp_IDs) > 0:
+        logger.info(
+            "Parsed "
+            + str(len(changed_plates))
+            + " new or changed plates, removed "
+            + str(len(removed_plates))
+            + " plates."
+        )
+        # Stores parsed data in export directory
+        technical_data.to_csv(join(save_folder, "technical_data.csv"), index=False)
+        run_data.to_csv(join(save_folder, "run_data.csv"), index=False)
+        carbon_source_data.to_csv(
+            join(save_folder, "carbon_source_data.csv"), index=False
+        )
+        species_data.to_csv(join(save_folder, "species_data.csv"), index=False)
+        inhibitor_data.to_csv(join(save_folder, "inhibitor_data.csv"), index=False)
+        comment_data.to_csv(join(save_folder, "comment_data.csv"), index=False)
+        if len(measurement_dfs) > 0:
+            measurement_data = pd.concat(measurement_dfs)
+        else:
+            measurement_data = pd.DataFrame()
+        write_measurements(
+            measurement_data,
+            save_folder,
+            replaced_exp_IDs=stale_exp_IDs if len(manifest) > 0 else None,
         )
-        run_data = pd.concat([run_data, run])
-        carbon_source_data = pd.concat([carbon_source_data, carbon_source])
-        species_data = pd.concat([species_data, species])
-        inhibitor_data = pd.concat([inhibitor_data, inhibitor])
-        comment_data = pd.concat([comment_data, comment])
-        measurement_data = pd.concat([measurement_data, measurement])
-
-    # Stores parsed data in export directory
-    technical_data.to_csv(join(save_folder, "technical_data.csv"), index=False)
-    run_data.to_csv(join(save_folder, "run_data.csv"), index=False)
-    carbon_source_data.to_csv(join(save_folder, "carbon_source_data.csv"), index=False)
-    species_data.to_csv(join(save_folder, "species_data.csv"), index=False)
-    inhibitor_data.to_csv(join(save_folder, "inhibitor_data.csv"), index=False)
-    comment_data.to_csv(join(save_folder, "comment_data.csv"), index=False)
-    measurement_data.to_csv(join(save_folder, "measurement_data.csv"), index=False)
+    else:
+        logger.info("No new or changed plates found.")
+
+    with open(join(save_folder, "description.txt"), "w") as handle:
+        description = parse_project_description(data_dir, project)
+        handle.write(description)
 
     export_dfs = [
         technical_data,
@@ -448,10 +600,195 @@ def main(data_dir, project):
         run_data,
         inhibitor_data,
     ]
-    metadata_updated = pool_metadata(export_dfs, logger)
-    with open(join(save_folder, "description.txt"), "w") as handle:
-        description = parse_project_description(data_dir, project)
-        handle.write(description)
+    timing = (len(changed_plates), len(plate_names), perf_counter() - start)
+    return export_dfs, stale_exp_IDs, fingerprints, logger, timing
+
+
+def save_manifest(project, fingerprints):
+    with open(join("export", project, MANIFEST), "w") as handle:
+        json.dump(fingerprints, handle, indent=4)
+
+
+def try_ingest_project(data_dir, project, jobs=1, force=False):
+    # Used when several projects are ingested, a project that fails to parse
+    # is reported instead of stopping the other projects.
+    try:
+        return ingest_project(data_dir, project, jobs=jobs, force=force)
+    except (Exception, SystemExit) as error:
+        return repr(error)
+
+
+def find_projects(data_dir):
+    # All projects of the data directory except for the template.
+    projects = next(walk(data_dir))[1]
+    return sorted([project for project in projects if project != "TEMPLATE_PROJECT"])
+
+
+def fit_project(project, jobs, logger):
+    # Fits all species and carbon sources of a project and stores the results
+    # in the fit store of the project, which the Fitting page reads first.
+    # Groups with unchanged data are taken from the store, results of changed
+    # or removed data are dropped.
+    # The fitting and page modules load dash, plotly and matplotlib, which
+    # parsing alone does not need.
+    from pages.metadata import MetadataIndex, load_metadata
+    from pages import utils, fitting_utils
+
+    start = perf_counter()
+    metadata_index = MetadataIndex(load_metadata())
+    args = (
+        metadata_index.projects[1:],
+        metadata_index.species,
+        metadata_index.cs,
+        metadata_index,
+        "export",
+    )
+    project_metadata = utils.load_selected_metadata([project], ["All"], ["All"], args)
+    store = project_store("export", project)
+    n_fitted = 0
+    # Carbon sources whose measurements could not be read. Their results in the
+    # store are unknown, so it is not pruned.
+    unread = []
+    for carbon_source in project_metadata["carbon_source"].unique():
+        # Same selection as on the Fitting page for this carbon source
+        filtered_metadata = utils.load_selected_metadata(
+            [project], [carbon_source], ["All"], args
+        )
+        try:
+            measurement_index = MeasurementIndex(
+                utils.load_data_from_metadata(filtered_metadata, args)
+            )
+        except Exception as error:
+            logger.warning(
+                project + ": failed to read " + str(carbon_source) + ", " + repr(error)
+            )
+            unread.append(str(carbon_source))
+            continue
+        # Species are fitted one after another, so data which can not be fitted
+        # only affects its own group. A group is looked up in the store before
+        # it is fitted, a group which fails has no result for its current data.
+        for species in filtered_metadata["species"].unique():
+            group_metadata = filtered_metadata[filtered_metadata["species"] == species]
+            try:
+                (
+                    species_selected,
+                    carbon_source_selected,
+                    concentrations_present,
+                    lg_replicates,
+                    fitting_comments,
+                ) = fitting_utils.restructure_metadata_fitting(group_metadata)
+                dfs_fitted, fit_values, fitting_comments = (
+                    fitting_utils.main_fit_function(
+                        measurement_index,
+                        concentrations_present,
+                        lg_replicates,
+                        fitting_comments,
+                        workers=jobs,
+                        cache=store,
+                    )
+                )
+            except Exception as error:
+                logger.warning(
+                    project
+                    + ": failed to fit "
+                    + str(species)
+                    + " on "
+                    + str(carbon_source)
+                    + ", "
+                    + repr(error)
+                )
+                continue
+            n_fitted += sum(
+                len(values) > 0 for sp_values in fit_values for values in sp_values
+            )
+    if len(unread) > 0:
+        logger.warning(
+            project + ": kept previous fit results, could not read " + ", ".join(unread)
+        )
+    else:
+        store.prune()
+    logger.info(
+        project
+        + ": fitted "
+        + str(n_fitted)
+        + " species and carbon source combinations in "
+        + "{:.1f}".format(perf_counter() - start)
+        + " s."
+    )
+
+
+def try_fit_project(project, jobs, logger):
+    try:
+        fit_project(project, jobs, logger)
+    except Exception as error:
+        logger.error(project + ": failed to fit, " + repr(error))
+
+
+def main(data_dir, projects, jobs=1, force=False, fit=False):
+    # Ingests the projects and pools their metadata once at the end.
+    # A single project is parsed with jobs plates in parallel, several projects
+    # are parsed with jobs projects in parallel.
+    if len(projects) == 1:
+        results = [ingest_project(data_dir, projects[0], jobs=jobs, force=force)]
+        # Pooling is logged to the log of the last plate
+        logger = results[0][3]
+    else:
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(
+                    executor.map(
+                        try_ingest_project,
+                        repeat(data_dir),
+                        projects,
+                        repeat(1),
+                        repeat(force),
+                    )
+                )
+        else:
+            results = [
+                try_ingest_project(data_dir, project, force=force)
+                for project in projects
+            ]
+        logger = create_log("ingest", join("metadata", "ingest.log"))
+        for project, result in zip(projects, results):
+            if isinstance(result, str):
+                logger.error(project + ": failed to parse, " + result)
+        projects = [
+            project
+            for project, result in zip(projects, results)
+            if not isinstance(result, str)
+        ]
+        results = [result for result in results if not isinstance(result, str)]
+        if len(results) == 0:
+            return
+
+    export_dfs = [
+        pd.concat(tables) for tables in zip(*[result[0] for result in results])
+    ]
+    stale_exp_IDs = [exp_ID for result in results for exp_ID in result[1]]
+    metadata_updated = pool_metadata(export_dfs, logger, stale_exp_IDs)
+    # Manifests are only updated once the metadata is pooled
+    for project, result in zip(projects, results):
+        save_manifest(project, result[2])
+
+    if len(results) > 1:
+        for project, result in zip(projects, results):
+            n_parsed, n_plates, seconds = result[4]
+            logger.info(
+                project
+                + ": parsed "
+                + str(n_parsed)
+                + " of "
+                + str(n_plates)
+                + " plates in "
+                + "{:.1f}".format(seconds)
+                + " s."
+            )
+
+    # Fits are computed once the pooled metadata is up to date
+    if fit:
+        for project in projects:
+            try_fit_project(project, jobs, logger)
 
 
 if __name__ == "__main__":
@@ -461,7 +798,38 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "project",
-        help="""This is the project name which corresponds to the folder name in the data directory.""",
+        nargs="*",
+        help="""This is the project name which corresponds to the folder name in the data directory.
+        Several projects can be passed.""",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="""Parse all projects in the data directory.""",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="""Number of plates, or projects if several are passed, parsed in parallel.""",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="""Parse all plates, also the ones unchanged since the last ingest.""",
+    )
+    parser.add_argument(
+        "--fit",
+        action="store_true",
+        help="""Fit all species and carbon sources of the projects after parsing,
+        the Fitting page then serves these results.""",
     )
     args = parser.parse_args()
-    main("data", args.project)
+    if args.all:
+        projects = find_projects("data")
+    elif len(args.project) > 0:
+        projects = args.project
+    else:
+        parser.error("Pass at least one project or --all.")
+    main("data", projects, jobs=args.jobs, force=args.force, fit=args.fit)
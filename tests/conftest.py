@@ -0,0 +1,5 @@
+from os.path import dirname, abspath
+import sys
+
+# Modules are imported from the repository root, as by dashboard.py
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
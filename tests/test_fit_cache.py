@@ -0,0 +1,33 @@
+import pickle
+import pytest
+from pages.fit_cache import FitCache
+
+
+def test_prune_keeps_used_results(tmp_path):
+    path = str(tmp_path / "fit_results.sqlite")
+    FitCache(path).put("old", 1)
+    store = FitCache(path, track_used=True)
+    store.put("new", 2)
+    assert store.prune() == 1
+    assert FitCache(path).get("old") is None
+    assert FitCache(path).get("new") == 2
+
+
+def test_untracked_cache_can_not_be_pruned(tmp_path):
+    cache = FitCache(str(tmp_path / "fit_cache.sqlite"))
+    cache.put("key", 1)
+    assert cache.get("key") == 1
+    assert cache.used is None
+    with pytest.raises(ValueError):
+        cache.prune()
+
+
+def test_size_limit_drops_oldest_results(tmp_path):
+    path = str(tmp_path / "fit_cache.sqlite")
+    # Room for about two of the pickled results
+    cache = FitCache(path, size_limit=2 * len(pickle.dumps(b"x" * 1000)) + 10)
+    for key in ["first", "second", "third"]:
+        cache.put(key, b"x" * 1000)
+    assert cache.get("first") is None
+    assert cache.get("second") == b"x" * 1000
+    assert cache.get("third") == b"x" * 1000
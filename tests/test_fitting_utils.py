@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.integrate import odeint
+from pages import fitting_utils
+from pages.fit_cache import FitCache
+from pages.measurements import MeasurementIndex
+
+# Grid of the dimensionless Monod model, Km close to 0 gives a sharp kink
+# when the substrate runs out.
+KM_VALUES = [1e-6, 1e-3, 0.1, 1, 10, 100]
+Q_VALUES = [0.01, 1, 100]
+TAU = np.linspace(0, 20, 400)
+
+
+def reference_biomass(tau, Km, q):
+    # Dimensionless biomass integrated with odeint at tight tolerances
+    return odeint(
+        fitting_utils.monod,
+        [1, 1],
+        tau,
+        args=(1, Km, q),
+        Dfun=fitting_utils.monod_jacobian,
+        rtol=1e-10,
+        atol=1e-12,
+    )[:, 0]
+
+
+@pytest.mark.parametrize("Km", KM_VALUES)
+@pytest.mark.parametrize("q", Q_VALUES)
+def test_solve_monod_matches_odeint(Km, q):
+    biomass = fitting_utils.solve_monod(TAU, Km, q)
+    # Deviation relative to the final biomass 1 + q
+    np.testing.assert_allclose(
+        biomass, reference_biomass(TAU, Km, q), rtol=0, atol=1e-7 * (1 + q)
+    )
+
+
+@pytest.mark.parametrize("Km", KM_VALUES)
+@pytest.mark.parametrize("q", Q_VALUES)
+def test_integrate_monod_matches_odeint(Km, q):
+    biomass = fitting_utils.integrate_monod(TAU, Km, q)[0]
+    # Deviation relative to the final biomass 1 + q
+    np.testing.assert_allclose(
+        biomass, reference_biomass(TAU, Km, q), rtol=0, atol=5e-4 * (1 + q)
+    )
+
+
+def test_integrate_monod_rows_are_independent():
+    # Stacked rows give the same result as integrating every row alone
+    tau = np.stack([TAU, TAU / 2])
+    biomass = fitting_utils.integrate_monod(tau, [0.1, 10], [1, 100])
+    for row, (Km, q) in enumerate([(0.1, 1), (10, 100)]):
+        np.testing.assert_allclose(
+            biomass[row], reference_biomass(tau[row], Km, q), atol=5e-4 * (1 + q)
+        )
+
+
+def test_integrate_monod_returns_nan_for_invalid_parameters():
+    # q = 0 gives non-finite rates, the integration must stop
+    with np.errstate(divide="ignore", invalid="ignore"):
+        biomass = fitting_utils.integrate_monod(np.linspace(0, 5, 10), 0.5, 0.0)
+    assert biomass.shape == (1, 10)
+    assert np.all(np.isnan(biomass))
+
+
+# Relative error of the analytic gradients, which are as exact as the solver
+GRADIENT_RTOL = {"odeint": 1e-5, "closed_form": 1e-6, "rk45": 2e-3}
+GRADIENT_TIMES = [np.linspace(0, 10, 60), np.linspace(0, 12, 80)]
+GRADIENT_C0 = [1.0, 0.5]
+GRADIENT_N0 = [0.02, 0.03]
+GRADIENT_Q = [0.4, 0.5]
+# Monod growth with v = 0.8 and Km = 0.3 and a deviation, so the residuals are
+# not zero at the optimum
+GRADIENT_N = [
+    fitting_utils.monod_biomass(t, n0, c0, 0.8, 0.3, q, "closed_form")
+    * (1 + 0.02 * np.sin(t))
+    for t, n0, c0, q in zip(GRADIENT_TIMES, GRADIENT_N0, GRADIENT_C0, GRADIENT_Q)
+]
+
+
+def central_difference(objective, params, h=1e-6):
+    params = np.asarray(params, dtype=float)
+    return np.array(
+        [
+            (objective(params + step)[0] - objective(params - step)[0]) / (2 * h)
+            for step in h * np.eye(len(params))
+        ]
+    )
+
+
+@pytest.mark.parametrize("solver", GRADIENT_RTOL.keys())
+@pytest.mark.parametrize("params", [(0.01, 0.9), (0.5, 0.6), (2.0, 1.0)])
+def test_monod_objective_gradient(solver, params):
+    def objective(params, solver):
+        return fitting_utils.monod_objective(
+            params,
+            GRADIENT_TIMES,
+            GRADIENT_Q,
+            GRADIENT_N,
+            GRADIENT_C0,
+            GRADIENT_N0,
+            solver,
+        )
+
+    # The closed form is the most accurate reference for the differences
+    expected = central_difference(lambda p: objective(p, "closed_form"), params)
+    gradient = objective(params, solver)[1]
+    np.testing.assert_allclose(gradient, expected, rtol=GRADIENT_RTOL[solver])
+
+
+@pytest.mark.parametrize("solver", GRADIENT_RTOL.keys())
+@pytest.mark.parametrize("Km", [0.05, 0.5, 3.0])
+def test_monod_Km_objective_gradient(solver, Km):
+    def objective(Km, solver):
+        args = [
+            0.8,
+            GRADIENT_TIMES[0],
+            GRADIENT_Q[0],
+            GRADIENT_N[0],
+            GRADIENT_C0[0],
+            GRADIENT_N0[0],
+            solver,
+        ]
+        return fitting_utils.monod_Km_objective(Km, args)
+
+    expected = central_difference(lambda Km: objective(Km, "closed_form"), [Km])
+    gradient = objective(np.array([Km]), solver)[1]
+    np.testing.assert_allclose(gradient, expected, rtol=GRADIENT_RTOL[solver])
+
+
+def fit_concentrations(series):
+    # Fits one species and carbon source with the measurements given as
+    # {concentration: measurements}, without a fit cache.
+    time = np.linspace(0, 20, 100)
+    measurements = pd.concat(
+        [
+            pd.DataFrame({"linegroup": str(conc), "time": time, "measurement": values})
+            for conc, values in series.items()
+        ]
+    )
+    return fitting_utils.main_fit_function(
+        MeasurementIndex(measurements),
+        [[list(series.keys())]],
+        [[[[str(conc)] for conc in series.keys()]]],
+        [[""]],
+        workers=1,
+        solver="closed_form",
+        cache=FitCache(""),
+    )
+
+
+def test_group_below_threshold_is_not_fitted():
+    dfs_fitted, fit_values, fitting_comments = fit_concentrations(
+        {1.0: np.linspace(0.01, 0.04, 100), 0.5: np.linspace(0.01, 0.03, 100)}
+    )
+    assert dfs_fitted == [[[]]]
+    assert fit_values == [[[]]]
+
+
+def test_concentrations_without_growth_are_skipped():
+    # The highest concentration has no data, the fit uses the second one
+    growth = fitting_utils.monod_biomass(
+        np.linspace(0, 20, 100), 0.01, 0.5, 0.5, 0.1, 1.0, "closed_form"
+    )
+    dfs_fitted, fit_values, fitting_comments = fit_concentrations(
+        {1.0: np.full(100, np.nan), 0.5: growth}
+    )
+    assert dfs_fitted[0][0][0] == []
+    assert len(dfs_fitted[0][0][1]) > 0
+    assert len(fit_values[0][0]) == 2
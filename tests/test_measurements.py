@@ -0,0 +1,77 @@
+from os import getpid, utime
+import pandas as pd
+from pages.measurements import MEASUREMENT_CSV, MeasurementCache
+
+
+def write_export(tmp_path, project, n_rows, mtime_ns=10**18):
+    # CSV export of a project with one linegroup
+    export = tmp_path / project
+    export.mkdir(exist_ok=True)
+    pd.DataFrame(
+        {"linegroup": project + "_A1", "time": range(n_rows), "measurement": 1.0}
+    ).to_csv(export / MEASUREMENT_CSV, index=False)
+    utime(export / MEASUREMENT_CSV, ns=(mtime_ns, mtime_ns))
+
+
+def entry_bytes(tmp_path, project):
+    cache = MeasurementCache(10**9)
+    cache.get(str(tmp_path), project)
+    return cache.n_bytes
+
+
+def test_least_recently_used_project_is_evicted(tmp_path):
+    for project in ["a", "b", "c"]:
+        write_export(tmp_path, project, 100)
+    # Room for two projects
+    cache = MeasurementCache(2 * entry_bytes(tmp_path, "a"))
+    cache.get(str(tmp_path), "a")
+    cache.get(str(tmp_path), "b")
+    cache.get(str(tmp_path), "a")
+    cache.get(str(tmp_path), "c")
+    assert cache.stats()["projects"] == ["a", "c"]
+    assert cache.n_bytes <= cache.max_bytes
+
+
+def test_project_larger_than_budget_is_not_cached(tmp_path):
+    write_export(tmp_path, "a", 10)
+    write_export(tmp_path, "b", 1000)
+    cache = MeasurementCache(2 * entry_bytes(tmp_path, "a"))
+    cache.get(str(tmp_path), "a")
+    assert len(cache.get(str(tmp_path), "b")) == 1000
+    assert cache.stats()["projects"] == ["a"]
+    assert cache.n_bytes == entry_bytes(tmp_path, "a")
+
+
+def test_changed_export_is_read_again(tmp_path):
+    write_export(tmp_path, "a", 10)
+    cache = MeasurementCache(10**9)
+    cache.get(str(tmp_path), "a")
+    cache.get(str(tmp_path), "a")
+    write_export(tmp_path, "a", 20, mtime_ns=2 * 10**18)
+    assert len(cache.get(str(tmp_path), "a")) == 20
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_watched_cache_trusts_entries_until_invalidated(tmp_path):
+    write_export(tmp_path, "a", 10)
+    write_export(tmp_path, "b", 10)
+    cache = MeasurementCache(10**9)
+    cache.watched_pid = getpid()
+    cache.get(str(tmp_path), "a")
+    cache.get(str(tmp_path), "b")
+    write_export(tmp_path, "a", 20, mtime_ns=2 * 10**18)
+    # The export is not checked on get while a watcher runs
+    assert len(cache.get(str(tmp_path), "a")) == 10
+    assert cache.invalidate_changed() == ["a"]
+    assert cache.stats()["projects"] == ["b"]
+    assert len(cache.get(str(tmp_path), "a")) == 20
+
+
+def test_removed_export_is_invalidated(tmp_path):
+    write_export(tmp_path, "a", 10)
+    cache = MeasurementCache(10**9)
+    cache.get(str(tmp_path), "a")
+    (tmp_path / "a" / MEASUREMENT_CSV).unlink()
+    assert cache.invalidate_changed() == ["a"]
+    assert cache.n_bytes == 0
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from os import getpid, utime
+import numpy as np
+import pandas as pd
+import pytest
+from pages.measurements import MEASUREMENT_CSV, measurement_cache
+from pages.metadata import MetadataIndex, MetadataService, load_metadata
+
+
+def write_project(tmp_path, linegroups, mtime_ns):
+    # Export and pooled metadata of one project as written by an ingest
+    export = tmp_path / "export" / "p"
+    export.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame({"linegroup": linegroups, "time": 0.0, "measurement": 1.0}).to_csv(
+        export / MEASUREMENT_CSV, index=False
+    )
+    pd.DataFrame(
+        {
+            "project": "p",
+            "exp_ID": "p_plate",
+            "linegroup": linegroups,
+            "species": "s",
+            "carbon_source": "c",
+        }
+    ).to_csv(tmp_path / "metadata.csv", index=False)
+    for path in [export / MEASUREMENT_CSV, export, tmp_path / "metadata.csv"]:
+        utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_reload_drops_watched_measurements(tmp_path, monkeypatch):
+    monkeypatch.setattr(measurement_cache, "entries", OrderedDict())
+    monkeypatch.setattr(measurement_cache, "n_bytes", 0)
+    # Cached measurements are not checked on get while a watcher runs
+    monkeypatch.setattr(measurement_cache, "watched_pid", getpid())
+    export_dir = str(tmp_path / "export")
+    write_project(tmp_path, ["p_A1"], 10**18)
+    service = MetadataService(str(tmp_path / "metadata.csv"))
+    service.current()
+    assert list(measurement_cache.get(export_dir, "p")["linegroup"]) == ["p_A1"]
+
+    write_project(tmp_path, ["p_A1", "p_A2"], 2 * 10**18)
+    index = service.current()
+    measurements = measurement_cache.get(export_dir, "p")
+    assert set(index.df["linegroup"]) <= set(measurements["linegroup"])
+
+
+def write_pooled_metadata(tmp_path):
+    # Pooled metadata of three projects, with species and carbon sources shared
+    # between projects and the rows of a project not next to each other
+    rng = np.random.default_rng(0)
+    n_rows = 300
+    projects = rng.choice(["p1", "p2", "p3"], n_rows)
+    pd.DataFrame(
+        {
+            "project": projects,
+            "exp_ID": [project + "_plate" for project in projects],
+            "linegroup": [f"lg{row}" for row in range(n_rows)],
+            "species": rng.choice(["s1", "s2", "s3", "s4"], n_rows),
+            "carbon_source": rng.choice(["glucose", "acetate", "water"], n_rows),
+        }
+    ).to_csv(tmp_path / "metadata.csv", index=False)
+    return load_metadata(str(tmp_path / "metadata.csv"))
+
+
+def isin_mask(df, column, values):
+    # Mask as used before the index, "All" stands for every value of the column
+    if "All" in values:
+        return pd.Series(True, index=df.index)
+    return df[column].isin(values)
+
+
+@pytest.mark.parametrize(
+    "projects, carbon_sources, species",
+    [
+        (["All"], ["All"], ["All"]),
+        (["p1"], ["All"], ["All"]),
+        (["p3", "p1"], ["acetate"], ["All"]),
+        (["All"], ["water", "glucose"], ["s2", "s4"]),
+        (["p1", "p2", "All"], ["acetate"], ["s1"]),
+        (["p2"], ["glucose"], ["s3", "unknown"]),
+        (["unknown"], ["All"], ["All"]),
+        ([], ["All"], ["All"]),
+        (["p1"], [], ["s1"]),
+    ],
+)
+def test_select_matches_isin_masks(tmp_path, projects, carbon_sources, species):
+    df = write_pooled_metadata(tmp_path)
+    assert isinstance(df["project"].dtype, pd.CategoricalDtype)
+    assert df["linegroup"].dtype == "string[pyarrow]"
+    expected = df[
+        isin_mask(df, "project", projects)
+        & isin_mask(df, "carbon_source", carbon_sources)
+        & isin_mask(df, "species", species)
+    ]
+    selected = MetadataIndex(df).select(projects, carbon_sources, species)
+    pd.testing.assert_frame_equal(selected, expected)
+
+
+@pytest.mark.parametrize(
+    "linegroups", [["lg5", "lg1", "lg299"], ["lg7", "unknown"], [], ["unknown"]]
+)
+def test_select_linegroups_matches_isin_mask(tmp_path, linegroups):
+    df = write_pooled_metadata(tmp_path)
+    expected = df[df["linegroup"].isin(linegroups)]
+    selected = MetadataIndex(df).select_linegroups(linegroups)
+    pd.testing.assert_frame_equal(selected, expected)
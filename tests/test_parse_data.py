@@ -0,0 +1,209 @@
+from collections import OrderedDict
+from datetime import time, timedelta
+from logging import getLogger
+from os import makedirs, utime
+from os.path import abspath, dirname, join
+from shutil import copyfile, copytree, rmtree
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+import parse_data
+from pages import fitting_utils, utils
+from pages.fit_cache import project_store
+from pages.measurements import (
+    MEASUREMENT_CSV,
+    MEASUREMENT_DATASET,
+    export_mtime,
+    measurement_cache,
+)
+
+logger = getLogger("test")
+
+
+def reference_hours(time_column):
+    # Per-cell conversion which convert_time replaced
+    ts = []
+    for i in time_column:
+        if type(i) is time:
+            ts.append(i.hour * 60 * 60 + i.minute * 60 + i.second)
+        elif type(i) is timedelta:
+            ts.append(i.total_seconds())
+        elif type(i) is str:
+            hour, minute, second = i.split(":")
+            ts.append(int(hour) * 60 * 60 + int(minute) * 60 + int(second))
+        elif type(i) is float:
+            ts.append(i * 86400)
+    return np.array(ts) / 60 / 60
+
+
+def time_objects(minutes):
+    return [time(m // 60, m % 60, 7) for m in minutes]
+
+
+def timedeltas(minutes):
+    return [timedelta(minutes=m, seconds=7) for m in minutes]
+
+
+TIME_COLUMNS = {
+    "time": time_objects(range(0, 24 * 60, 10)),
+    "timedelta": timedeltas(range(0, 48 * 60, 10)),
+    "string": ["{}:{:02d}:07".format(m // 60, m % 60) for m in range(0, 48 * 60, 10)],
+    "fraction of days": [m / 60 / 24 for m in range(0, 48 * 60, 10)],
+}
+
+
+@pytest.mark.parametrize("name", TIME_COLUMNS.keys())
+def test_convert_time(name):
+    # Cells as read by openpyxl, only a column of floats gets a numeric dtype
+    dtype = float if name == "fraction of days" else object
+    column = pd.Series(TIME_COLUMNS[name], dtype=dtype)
+    hours = parse_data.convert_time(column, logger) / 60 / 60
+    np.testing.assert_allclose(hours, reference_hours(column))
+
+
+def test_convert_time_excel_switch_past_24_hours():
+    # Excel writes times of day up to 24 hours, timedeltas afterwards
+    column = pd.Series(
+        time_objects(range(0, 24 * 60, 10)) + timedeltas(range(24 * 60, 48 * 60, 10)),
+        dtype=object,
+    )
+    hours = parse_data.convert_time(column, logger) / 60 / 60
+    np.testing.assert_allclose(hours, reference_hours(column))
+    assert np.all(np.diff(hours) > 0)
+
+
+def write_fit_project(tmp_path, monkeypatch):
+    # Export and pooled metadata of a project with two species which do not
+    # grow, in the layout parse_data.py reads from the working directory.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(measurement_cache, "entries", OrderedDict())
+    monkeypatch.setattr(measurement_cache, "n_bytes", 0)
+    (tmp_path / "metadata").mkdir()
+    (tmp_path / "export" / "p").mkdir(parents=True)
+    linegroups = ["p_A1", "p_A2"]
+    pd.concat(
+        [
+            pd.DataFrame({"linegroup": lg, "time": range(10), "measurement": 0.01})
+            for lg in linegroups
+        ]
+    ).to_csv(tmp_path / "export" / "p" / MEASUREMENT_CSV, index=False)
+    pd.DataFrame(
+        {
+            "project": "p",
+            "exp_ID": "p_plate",
+            "linegroup": linegroups,
+            "species": ["fails", "flat"],
+            "carbon_source": "c",
+            "cs_conc": 1.0,
+        }
+    ).to_csv(tmp_path / "metadata" / "pooled_df_joint_metadata.csv", index=False)
+    store = project_store("export", "p")
+    store.put("stale", "result")
+    return store
+
+
+def test_fit_project_prunes_when_a_group_fails(tmp_path, monkeypatch):
+    store = write_fit_project(tmp_path, monkeypatch)
+    main_fit_function = fitting_utils.main_fit_function
+
+    def fail_species(measurement_index, concentrations, lg_replicates, *args, **kwargs):
+        if "p_A1" in lg_replicates[0][0][0]:
+            raise ValueError("can not be fitted")
+        return main_fit_function(
+            measurement_index, concentrations, lg_replicates, *args, **kwargs
+        )
+
+    monkeypatch.setattr(fitting_utils, "main_fit_function", fail_species)
+    parse_data.fit_project("p", 1, logger)
+    assert store.get("stale") is None
+
+
+def test_fit_project_keeps_results_of_unread_data(tmp_path, monkeypatch):
+    store = write_fit_project(tmp_path, monkeypatch)
+
+    def fail_reading(filtered_metadata, args):
+        raise OSError("can not be read")
+
+    monkeypatch.setattr(utils, "load_data_from_metadata", fail_reading)
+    parse_data.fit_project("p", 1, logger)
+    assert store.get("stale") == "result"
+
+
+DATA_DIR = join(dirname(dirname(abspath(__file__))), "data")
+
+
+def ingest(root, monkeypatch, force=False):
+    # Ingests the project p of root/data into root/export and root/metadata
+    monkeypatch.chdir(root)
+    makedirs("metadata", exist_ok=True)
+    parse_data.main("data", ["p"], force=force)
+
+
+def read_export(root):
+    # Exported tables, measurements and pooled metadata in a fixed row order
+    export = join(root, "export", "p")
+    tables = {
+        name: pd.read_csv(join(export, name + ".csv"), dtype=str, keep_default_na=False)
+        for name in parse_data.EXPORT_TABLES
+    }
+    # Dictionaries of the partitions depend on the order plates were written
+    tables["measurements"] = (
+        pq.read_table(join(export, MEASUREMENT_DATASET))
+        .to_pandas()
+        .astype({"exp_ID": str, "linegroup": str})
+    )
+    tables["pooled"] = pd.read_csv(
+        join(root, "metadata", "pooled_df_joint_metadata.csv"),
+        dtype=str,
+        keep_default_na=False,
+    )
+    return {
+        name: table.sort_values(list(table.columns)).reset_index(drop=True)
+        for name, table in tables.items()
+    }
+
+
+def test_incremental_ingest_matches_force(tmp_path, monkeypatch):
+    incremental = tmp_path / "incremental"
+    copytree(join(DATA_DIR, "240903_fran"), incremental / "data" / "p")
+    ingest(incremental, monkeypatch)
+    # One plate is changed and one is removed
+    plates = incremental / "data" / "p"
+    copyfile(
+        plates / "nut_gradient_repeat_2_plate_1" / "data.xlsx",
+        plates / "nut_gradient_repeat_1_plate_1" / "data.xlsx",
+    )
+    rmtree(plates / "nut_gradient_repeat_3_plate_2")
+    ingest(incremental, monkeypatch)
+
+    forced = tmp_path / "forced"
+    copytree(incremental / "data", forced / "data")
+    ingest(forced, monkeypatch, force=True)
+
+    incremental_export, forced_export = read_export(incremental), read_export(forced)
+    for name, table in forced_export.items():
+        pd.testing.assert_frame_equal(incremental_export[name], table, obj=name)
+    assert "p_nut_gradient_repeat_3_plate_2" not in set(
+        incremental_export["pooled"]["exp_ID"]
+    )
+
+
+def test_unchanged_ingest_parses_nothing(tmp_path, monkeypatch):
+    copytree(join(DATA_DIR, "240903_fran"), tmp_path / "data" / "p")
+    ingest(tmp_path, monkeypatch)
+    exported = read_export(tmp_path)
+    mtime = export_mtime("export", "p")
+
+    parsed = []
+    monkeypatch.setattr(
+        parse_data, "parse_plate", lambda *plate: parsed.append(plate)
+    )
+    # Touching a file changes its mtime but not its content
+    utime(tmp_path / "data" / "p" / "nut_gradient_repeat_1_plate_1" / "data.xlsx")
+    ingest(tmp_path, monkeypatch)
+
+    assert parsed == []
+    assert export_mtime("export", "p") == mtime
+    for name, table in read_export(tmp_path).items():
+        pd.testing.assert_frame_equal(table, exported[name], obj=name)
@@ -0,0 +1,38 @@
+import diskcache
+import pytest
+from pages import sessions
+
+
+@pytest.fixture
+def session_cache(tmp_path, monkeypatch):
+    cache = diskcache.Cache(str(tmp_path / "sessions"))
+    monkeypatch.setattr(sessions, "session_cache", cache)
+    yield cache
+    cache.close()
+
+
+def test_selection_is_loaded_per_session(session_cache):
+    sessions.save_selection("a", ["p_A1", "p_A2"])
+    sessions.save_selection("b", iter(["p_B1"]))
+    assert sessions.load_selection("a") == ["p_A1", "p_A2"]
+    assert sessions.load_selection("b") == ["p_B1"]
+
+
+def test_unknown_session_has_no_selection(session_cache):
+    sessions.save_selection("a", ["p_A1"])
+    assert sessions.load_selection("b") is None
+    assert sessions.load_selection(None) is None
+
+
+def test_cleared_selection_replaces_the_last_one(session_cache):
+    # The viewer stores an empty selection once nothing is selected, the
+    # download must not serve the linegroups selected before
+    sessions.save_selection("a", ["p_A1"])
+    sessions.save_selection("a", [])
+    assert sessions.load_selection("a") == []
+
+
+def test_selection_expires(session_cache, monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_EXPIRE", 0)
+    sessions.save_selection("a", ["p_A1"])
+    assert sessions.load_selection("a") is None
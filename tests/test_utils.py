@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pages import utils
+from pages.measurements import MeasurementIndex
+
+
+def replicate_data(series):
+    # Measurements and metadata of linegroups given as {linegroup: (times, cs_conc)}
+    measurements = pd.concat(
+        [
+            pd.DataFrame({"linegroup": lg, "time": times, "measurement": times * 2})
+            for lg, (times, _) in series.items()
+        ]
+    )
+    metadata = pd.DataFrame(
+        {
+            "linegroup": list(series.keys()),
+            "project": "project",
+            "species": "species",
+            "carbon_source": "glucose",
+            "cs_conc": [conc for _, conc in series.values()],
+        }
+    )
+    return MeasurementIndex(measurements), metadata
+
+
+def test_aggregate_replicates_uses_time_grid_of_first_replicate():
+    # The first replicate is shorter, its grid must not be extended with the
+    # timepoints of the second one.
+    measurement_index, metadata = replicate_data(
+        {
+            "a": (np.array([0.0, 1.0, 2.0]), 1.0),
+            "b": (np.array([0.5, 1.5, 2.5, 3.5]), 1.0),
+        }
+    )
+    aggregated = utils.aggregate_replicates(measurement_index, metadata)
+    group = aggregated[("project", "species", "glucose", 1.0)]
+    np.testing.assert_allclose(group["time"], [0.0, 1.0, 2.0])
+    np.testing.assert_allclose(group["mean"], [0.0, 2.0, 4.0])
+    np.testing.assert_array_equal(group["n"], [1, 2, 2])
+
+
+def test_aggregate_replicates_ignores_points_past_first_replicate():
+    # The second replicate is longer, its last point has no time in the grid
+    measurement_index, metadata = replicate_data(
+        {
+            "a": (np.array([0.0, 1.0, 2.0]), 1.0),
+            "b": (np.array([0.0, 1.0, 2.0, 3.0]), 1.0),
+        }
+    )
+    aggregated = utils.aggregate_replicates(measurement_index, metadata)
+    group = aggregated[("project", "species", "glucose", 1.0)]
+    np.testing.assert_allclose(group["time"], [0.0, 1.0, 2.0])
+    np.testing.assert_allclose(group["mean"], [0.0, 2.0, 4.0])
+    np.testing.assert_array_equal(group["n"], [2, 2, 2])
+
+
+def test_aggregate_replicates_skips_groups_with_missing_values():
+    measurement_index, metadata = replicate_data(
+        {
+            "a": (np.array([0.0, 1.0]), 1.0),
+            "b": (np.array([0.0, 1.0]), np.nan),
+        }
+    )
+    aggregated = utils.aggregate_replicates(measurement_index, metadata)
+    assert list(aggregated) == [("project", "species", "glucose", 1.0)]
+    np.testing.assert_allclose(
+        aggregated[("project", "species", "glucose", 1.0)]["mean"], [0.0, 2.0]
+    )
+
+
+def bucket_extremes(values, max_points):
+    # Smallest and largest value of every bucket of minmax_indices
+    n_buckets = max(max_points // 2, 1)
+    bucket = np.arange(len(values)) * n_buckets // len(values)
+    return [
+        (np.nanmin(values[bucket == b]), np.nanmax(values[bucket == b]))
+        for b in range(n_buckets)
+    ]
+
+
+def test_minmax_indices_keeps_all_points_within_budget():
+    np.testing.assert_array_equal(utils.minmax_indices(np.ones(50), 50), np.arange(50))
+
+
+@pytest.mark.parametrize("max_points", [2, 10, 101, 400])
+def test_minmax_indices_keeps_extremes_of_every_bucket(max_points):
+    rng = np.random.default_rng(0)
+    values = np.cumsum(rng.normal(size=1000))
+    values[rng.choice(1000, 50, replace=False)] = np.nan
+    indices = utils.minmax_indices(values, max_points)
+    assert len(indices) <= max_points + 2
+    assert indices[0] == 0 and indices[-1] == 999
+    kept = set(values[indices][~np.isnan(values[indices])])
+    for low, high in bucket_extremes(values, max_points):
+        assert low in kept and high in kept
+
+
+def test_plot_indices_adds_detail_in_x_range():
+    time = np.linspace(0, 100, 10001)
+    values = np.sin(time)
+    overview = utils.plot_indices(time, values, 100)
+    zoomed = utils.plot_indices(time, values, 100, x_range=(10, 20))
+    assert set(overview) <= set(zoomed)
+    visible = zoomed[(time[zoomed] >= 10) & (time[zoomed] <= 20)]
+    assert len(visible) >= 90
+    # The points next to the range are kept so the trace reaches its edges
+    assert time[zoomed][np.searchsorted(time[zoomed], 10) - 1] < 10
+    assert time[zoomed][np.searchsorted(time[zoomed], 20, side="right")] > 20
+
+
+def test_plot_indices_without_budget_keeps_all_points():
+    time = np.arange(5000.0)
+    np.testing.assert_array_equal(
+        utils.plot_indices(time, time, None, x_range=(10, 20)), np.arange(5000)
+    )
+
+
+@pytest.mark.parametrize(
+    "relayout_data, x_range",
+    [
+        (None, False),
+        ({"xaxis.range[0]": 1, "xaxis.range[1]": 2}, (1, 2)),
+        ({"xaxis.range": [3, 4]}, (3, 4)),
+        ({"xaxis.autorange": True}, None),
+        ({"autosize": True}, False),
+        ({"yaxis.range[0]": 0, "yaxis.range[1]": 1}, False),
+    ],
+)
+def test_relayout_x_range(relayout_data, x_range):
+    assert utils.relayout_x_range(relayout_data) == x_range